@@ -0,0 +1,260 @@
+"""Check what running each kannwas command costs in imports.
+
+    python benchmarks/imports.py [--runs 3] [--command roster] [--update-budget]
+
+Every subcommand of the CLI runs under python -X importtime in a generated
+course directory, against the mock Canvas for the commands that need it, so
+the imports its body does lazily are timed too. Each run starts from a fresh
+copy of the course, so caches don't skip work. The import time of a run is
+the time spent importing modules a bare interpreter doesn't import, the best
+of --runs runs.
+
+The check fails if kannwas --help imports any of HEAVY, if a command imports
+one of HEAVY that its entry in benchmarks/import_budget.json doesn't list, or
+if its import time exceeds its budget there.
+"""
+
+from pathlib import Path
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import click
+
+from mock_canvas import Course, serve
+from run import generate_course, write
+
+
+BENCHMARKS = Path(__file__).resolve().parent
+BUDGET = BENCHMARKS / "import_budget.json"
+
+# Dependencies only the commands that use them may import
+HEAVY = [
+    "canvasapi",
+    "docker",
+    "frontmatter",
+    "httpx",
+    "mako",
+    "markdown",
+    "markdownify",
+    "numpy",
+    "pandas",
+    "pydantic",
+    "qrcode",
+    "requests",
+    "yaml",
+]
+
+# The startup every command pays, which must import none of HEAVY
+STARTUP = "(startup)"
+
+# How each command runs in the generated course. Building needs Docker, so
+# build runs with nothing to build
+ARGS = {
+    STARTUP: ["--help"],
+    "build": ["--no-lecture", "--no-assessments", "--no-extras"],
+    "clean": [],
+    "discussions": [],
+    "due": ["-a", "1"],
+    "moderate": ["-a", "1"],
+    "preprocess": [],
+    "publish": [],
+    "qr": [],
+    "roster": [],
+    "schedule": ["--weeks", "2", "--questions", "2", "a,b,c"],
+}
+
+# Commands that can't run here, timed by importing what their body imports:
+# padlet needs the Padlet API and start keeps serving until interrupted
+IMPORTS = {
+    "padlet": ["kannwas.padlet", "httpx"],
+    "start": [],
+}
+
+# --update-budget allows this much more than the measured import time
+HEADROOM = 2.0
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def imported(stderr: str) -> dict[str, int]:
+    """Map every module of a -X importtime report to its own import time in µs."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(1))
+    return modules
+
+
+def python_env() -> dict:
+    env = {
+        **os.environ,
+        "CANVAS_API_KEY": "benchmark",
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(BENCHMARKS.parent), os.environ.get("PYTHONPATH")])
+        ),
+    }
+    env.pop("PADLET_API_KEY", None)
+    return env
+
+
+def importtime(args, cwd) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=cwd,
+        env=python_env(),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise click.ClickException(
+            f"{' '.join(args)} exited with {result.returncode}:\n"
+            f"{result.stdout}{result.stderr[-2000:]}"
+        )
+    return imported(result.stderr)
+
+
+def commands() -> list[str]:
+    sys.path.insert(0, str(BENCHMARKS.parent))
+    from kannwas.cli import cli
+
+    return [STARTUP, *sorted(cli.commands)]
+
+
+def command_args(command) -> list[str]:
+    if command in IMPORTS:
+        modules = ", ".join(["kannwas.cli", *IMPORTS[command]])
+        return ["-c", f"import {modules}"]
+    if command not in ARGS:
+        raise click.ClickException(
+            f"No way to run {command} is known, add it to ARGS or IMPORTS"
+        )
+    cli = ["-c", "from kannwas.cli import cli; cli()"]
+    if command == STARTUP:
+        return [*cli, *ARGS[command]]
+    return [*cli, command, *ARGS[command]]
+
+
+def generate_inputs(root: Path, canvas_url: str):
+    """Write a small course plus the inputs of the offline commands."""
+    generate_course(root, canvas_url, pages=10, assignments=3, topics=2)
+    write(
+        root / "assessments" / "essay.md",
+        "---\ntitle: Essay\n---\nDue ${week_1 + timedelta(weeks=4)}\n",
+    )
+    write(
+        root / "padlet-setup.csv",
+        "workshop,week,breakout_room_link\nW01,1,https://example.com/1\n",
+    )
+
+
+def measure(command, runs, bare, course: Path) -> dict:
+    args = command_args(command)
+    best = None
+    for _ in range(runs):
+        cwd = course.with_name("run")
+        shutil.copytree(course, cwd)
+        try:
+            modules = importtime(args, cwd)
+        finally:
+            shutil.rmtree(cwd)
+        own = {name: time for name, time in modules.items() if name not in bare}
+        if best is None or sum(own.values()) < sum(best.values()):
+            best = own
+    heavy = sorted({name.split(".")[0] for name in best} & set(HEAVY))
+    slowest = sorted(best.items(), key=lambda item: -item[1])[:5]
+    return {
+        "args": args[2:] if command not in IMPORTS else args[1:],
+        "import_ms": round(sum(best.values()) / 1000, 1),
+        "modules": len(best),
+        "heavy": heavy,
+        "slowest": [f"{name} ({time / 1000:.1f} ms)" for name, time in slowest],
+    }
+
+
+@click.command()
+@click.option("--runs", default=3, type=click.IntRange(min=1), help="Runs per command")
+@click.option(
+    "--command",
+    "-c",
+    "selected",
+    multiple=True,
+    help="Check only these commands (default: all)",
+)
+@click.option(
+    "--update-budget",
+    is_flag=True,
+    help=f"Record {HEADROOM:g}x these import times as the new budget",
+)
+@click.option(
+    "--verbose", "-v", is_flag=True, help="Show each command's slowest imports"
+)
+def main(runs, selected, update_budget, verbose):
+    """Check the import time of every kannwas command against its budget."""
+    budget = json.loads(BUDGET.read_text()) if BUDGET.exists() else {}
+    server = serve(Course(students=100))
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="kannwas-imports-") as tmp:
+            course = Path(tmp) / "course"
+            generate_inputs(course, server.canvas.base_url)
+            bare = set(importtime(["-c", "pass"], course))
+            for command in commands():
+                if selected and command not in selected:
+                    continue
+                results[command] = measure(command, runs, bare, course)
+    finally:
+        server.shutdown()
+
+    failures = []
+    click.echo(f"{'command':<14} {'imports (ms)':>13} {'budget':>7} {'modules':>8}")
+    for command, result in results.items():
+        entry = budget.get(command, {})
+        allowed = entry.get("import_ms", "-")
+        click.echo(
+            f"{command:<14} {result['import_ms']:>13.1f} {allowed:>7} "
+            f"{result['modules']:>8}  {', '.join(result['heavy'])}"
+        )
+        if verbose:
+            click.echo(f"{'':<14} {', '.join(result['slowest'])}")
+        if command == STARTUP:
+            unexpected = result["heavy"]
+        else:
+            unexpected = [
+                name for name in result["heavy"] if name not in entry.get("heavy", [])
+            ]
+        if unexpected and not (update_budget and command != STARTUP):
+            failures.append(f"{command}: imports {', '.join(unexpected)}")
+        if not update_budget and allowed != "-" and result["import_ms"] > allowed:
+            failures.append(
+                f"{command}: {result['import_ms']} ms of imports, budget {allowed} ms"
+            )
+
+    if update_budget and not failures:
+        budget.update(
+            {
+                command: {
+                    "args": result["args"],
+                    "heavy": result["heavy"],
+                    "import_ms": math.ceil(result["import_ms"] * HEADROOM / 10) * 10,
+                }
+                for command, result in results.items()
+            }
+        )
+        BUDGET.write_text(json.dumps(budget, indent=1, sort_keys=True) + "\n")
+        click.echo(f"Budget written to {BUDGET}")
+
+    for failure in failures:
+        click.echo(f"Regression: {failure}", err=True)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,652 @@
+"""A local stand-in for the parts of the Canvas REST API that kannwas uses.
+
+The server keeps a synthetic course in memory and records every request it
+serves so the benchmarks can count requests, bytes and latency per command.
+"""
+
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+
+COURSE_ID = 1
+COURSE_CODE = "BENCH1001"
+RUBRIC = [
+    {"id": f"_{n}", "description": f"Criterion {n}", "points": 25.0}
+    for n in range(1, 5)
+]
+
+
+def parse_form(pairs) -> dict:
+    """Nest Canvas style form keys, e.g. wiki_page[title] or include[]."""
+    data = {}
+    for key, value in pairs:
+        parts = [key.split("[", 1)[0]] + re.findall(r"\[([^\]]*)\]", key)
+        node = data
+        for part, following in zip(parts, parts[1:] + [None]):
+            if following is None:
+                node[part] = value
+            elif following == "":
+                node.setdefault(part, []).append(value)
+                break
+            else:
+                node = node.setdefault(part, {})
+    return data
+
+
+def parse_batch(pairs, name) -> list[dict]:
+    """Split flattened name[][field] pairs back into a list of dicts."""
+    items = []
+    for key, value in pairs:
+        match = re.fullmatch(rf"{name}\[\]\[(\w+)\](\[\])?", key)
+        if match is None:
+            continue
+        field, is_list = match.groups()
+        if not items or (not is_list and field in items[-1]):
+            items.append({})
+        if is_list:
+            items[-1].setdefault(field, []).append(value)
+        else:
+            items[-1][field] = value
+    return items
+
+
+def timestamp(offset_days=0) -> str:
+    start = datetime(2025, 2, 24, tzinfo=timezone.utc)
+    return (start + timedelta(days=offset_days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Course(object):
+    """The synthetic course: students, groups, one marked assignment and
+    discussion topics with deep threads. Everything publish creates is added."""
+
+    def __init__(self, students=2000, topics=20, seed=1):
+        rng = random.Random(seed)
+        self.ids = itertools.count(1000)
+        self.users = []
+        for n in range(students):
+            self.users.append(
+                {
+                    "id": 10000 + n,
+                    "name": f"Student {n}",
+                    "sortable_name": f"{n}, Student",
+                    "sis_user_id": str(440000000 + n),
+                    "login_id": f"stud{n:04}",
+                    "email": f"stud{n:04}@example.edu",
+                    "enrollments": [
+                        {
+                            "type": "StudentEnrollment",
+                            "sis_course_id": COURSE_CODE,
+                            "sis_section_id": f"{COURSE_CODE}-T{n % 40:02}",
+                        }
+                    ],
+                }
+            )
+        self.categories = [
+            {"id": 1, "name": "Tutorial Groups"},
+            {"id": 2, "name": "Project Teams"},
+        ]
+        self.groups = []
+        for category, size in ((1, 5), (2, 4)):
+            for start in range(0, students, size):
+                members = self.users[start : start + size]
+                self.groups.append(
+                    {
+                        "id": next(self.ids),
+                        "name": f"{self.categories[category - 1]['name']} {start // size + 1}",
+                        "group_category_id": category,
+                        "users": [{"id": u["id"], "name": u["name"]} for u in members],
+                    }
+                )
+        self.assignment_groups = []
+        self.assignments = [
+            {
+                "id": 1,
+                "name": "Benchmark Essay",
+                "course_id": COURSE_ID,
+                "due_at": timestamp(30),
+                "lock_at": timestamp(37),
+                "unlock_at": timestamp(0),
+                "points_possible": 100.0,
+                "published": True,
+                "rubric": RUBRIC,
+            }
+        ]
+        self.submissions = {
+            1: {
+                user["id"]: {
+                    "id": next(self.ids),
+                    "user_id": user["id"],
+                    "assignment_id": 1,
+                    "score": None,
+                    "rubric_assessment": {
+                        criterion["id"]: {
+                            "rating_id": None,
+                            "comments": "",
+                            "points": float(rng.randint(10, 25)),
+                        }
+                        for criterion in RUBRIC
+                    },
+                }
+                for user in self.users
+            }
+        }
+        for submission in self.submissions[1].values():
+            submission["score"] = sum(
+                a["points"] for a in submission["rubric_assessment"].values()
+            )
+        self.overrides = {1: []}
+        self.pages = []
+        self.front_page = None
+        self.modules = []
+        self.module_items = {}
+        self.rubrics = []
+        self.files = []
+        self.progress = {}
+        self.topics = []
+        self.entries = {}
+        for n in range(topics):
+            topic = {
+                "id": next(self.ids),
+                "title": f"Case Study {n + 1}",
+                "message": f"<p>Discuss case study {n + 1}.</p>",
+                "discussion_type": "threaded",
+                "published": True,
+                "is_announcement": False,
+                "posted_at": timestamp(n),
+            }
+            self.topics.append(topic)
+            self.entries[topic["id"]] = [
+                self.thread(rng, depth=0) for _ in range(rng.randint(40, 80))
+            ]
+
+    def thread(self, rng, depth, parent_id=None) -> dict:
+        entry_id = next(self.ids)
+        user = rng.choice(self.users)
+        replies = []
+        if depth < 6:
+            replies = [
+                self.thread(rng, depth + 1, entry_id)
+                for _ in range(rng.choice((0, 0, 1, 1, 2)))
+            ]
+        return {
+            "id": entry_id,
+            "user_id": user["id"],
+            "parent_id": parent_id,
+            "created_at": timestamp(rng.randint(0, 90)),
+            "updated_at": timestamp(rng.randint(0, 90)),
+            "message": "<p>"
+            + " ".join(
+                f"<strong>point {i}</strong> about the case"
+                for i in range(rng.randint(2, 12))
+            )
+            + "</p>",
+            "replies": replies,
+        }
+
+
+class MockCanvas(object):
+    """Route Canvas API requests against a Course and record what they cost."""
+
+    def __init__(self, course: Course, latency=0.0):
+        self.course = course
+        self.latency = latency
+        self.base_url = None
+        self.records = []
+        self._lock = threading.Lock()
+        self.routes = []
+        for method, pattern, handler in self.route_table():
+            template = re.sub(r"\(\?P<(\w+)>[^)]*\)", r":\1", pattern)
+            self.routes.append(
+                (method, re.compile(pattern + "$"), f"{method} {template}", handler)
+            )
+
+    def route_table(self):
+        course = rf"/api/v1/courses/{COURSE_ID}"
+        return [
+            ("GET", course, self.get_course),
+            ("GET", rf"{course}/users", self.list_users),
+            ("GET", rf"{course}/search_users", self.list_users),
+            ("GET", rf"{course}/groups", self.list_groups),
+            ("GET", rf"{course}/group_categories", self.list_categories),
+            ("GET", rf"{course}/files", self.list_files),
+            ("POST", rf"{course}/files", self.upload_token),
+            ("POST", r"/files_api/upload", self.upload_file),
+            ("PUT", rf"{course}/front_page", self.edit_front_page),
+            ("GET", rf"{course}/pages", self.list_pages),
+            ("POST", rf"{course}/pages", self.create_page),
+            ("PUT", rf"{course}/pages/(?P<url>[\w-]+)", self.edit_page),
+            ("GET", rf"{course}/modules", self.list_modules),
+            ("POST", rf"{course}/modules", self.create_module),
+            ("PUT", rf"{course}/modules/(?P<id>\d+)", self.edit_module),
+            ("GET", rf"{course}/modules/(?P<id>\d+)/items", self.list_items),
+            ("POST", rf"{course}/modules/(?P<id>\d+)/items", self.create_item),
+            ("GET", rf"{course}/assignment_groups", self.list_assignment_groups),
+            ("POST", rf"{course}/assignment_groups", self.create_assignment_group),
+            ("GET", rf"{course}/assignments", self.list_assignments),
+            ("POST", rf"{course}/assignments", self.create_assignment),
+            ("PUT", rf"{course}/assignments/overrides", self.update_overrides),
+            ("POST", rf"{course}/assignments/overrides", self.create_overrides),
+            ("GET", rf"{course}/assignments/(?P<id>\d+)", self.get_assignment),
+            ("PUT", rf"{course}/assignments/(?P<id>\d+)", self.edit_assignment),
+            (
+                "GET",
+                rf"{course}/assignments/(?P<id>\d+)/overrides",
+                self.list_overrides,
+            ),
+            (
+                "DELETE",
+                rf"{course}/assignments/(?P<id>\d+)/overrides/(?P<override>\d+)",
+                self.delete_override,
+            ),
+            (
+                "GET",
+                rf"{course}/assignments/(?P<id>\d+)/submissions",
+                self.list_submissions,
+            ),
+            (
+                "POST",
+                rf"{course}/assignments/(?P<id>\d+)/submissions/update_grades",
+                self.update_grades,
+            ),
+            ("GET", r"/api/v1/progress/(?P<id>\d+)", self.get_progress),
+            ("GET", rf"{course}/rubrics", self.list_rubrics),
+            ("POST", rf"{course}/rubrics", self.create_rubric),
+            ("POST", rf"{course}/rubric_associations", self.create_rubric_association),
+            ("GET", r"/api/v1/announcements", self.list_announcements),
+            ("GET", rf"{course}/discussion_topics", self.list_topics),
+            ("POST", rf"{course}/discussion_topics", self.create_topic),
+            ("PUT", rf"{course}/discussion_topics/(?P<id>\d+)", self.edit_topic),
+            ("GET", rf"{course}/discussion_topics/(?P<id>\d+)/view", self.topic_view),
+        ]
+
+    def reset(self):
+        """Clear the recorded requests and return the ones recorded so far."""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def handle(self, method, target, body):
+        """Return (status, headers, payload, endpoint) for a request."""
+        url = urlsplit(target)
+        query = parse_qsl(url.query, keep_blank_values=True)
+        form = parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True)
+        for route_method, pattern, endpoint, handler in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                request = {
+                    "path": url.path,
+                    "query": query,
+                    "params": parse_form(query),
+                    "pairs": form,
+                    "form": parse_form(form),
+                    **match.groupdict(),
+                }
+                with self._lock:
+                    status, headers, payload = handler(request)
+                return status, headers, payload, endpoint
+        return 404, {}, {"errors": [{"message": "not found"}]}, f"{method} (unknown)"
+
+    def record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    # Helpers
+
+    def ok(self, payload, status=200, headers=None):
+        return status, headers or {}, payload
+
+    def paginate(self, request, items):
+        params = request["params"]
+        per_page = int(params.get("per_page", 10))
+        page = int(params.get("page", 1))
+        last = max(1, -(-len(items) // per_page))
+        query = [(k, v) for k, v in request["query"] if k not in ("page", "per_page")]
+
+        def link(number, rel):
+            url = f"{self.base_url}{request['path']}?" + urlencode(
+                query + [("page", number), ("per_page", per_page)]
+            )
+            return f'<{url}>; rel="{rel}"'
+
+        links = [link(page, "current"), link(1, "first"), link(last, "last")]
+        if page < last:
+            links.append(link(page + 1, "next"))
+        if page > 1:
+            links.append(link(page - 1, "prev"))
+        start = (page - 1) * per_page
+        return 200, {"Link": ",".join(links)}, items[start : start + per_page]
+
+    def find(self, items, key, value):
+        return next((item for item in items if str(item[key]) == str(value)), None)
+
+    def includes(self, request):
+        return request["params"].get("include", [])
+
+    # Course, roster and groups
+
+    def get_course(self, request):
+        return self.ok(
+            {"id": COURSE_ID, "name": "Benchmark", "course_code": COURSE_CODE}
+        )
+
+    def list_users(self, request):
+        users = self.course.users
+        if "enrollments" not in self.includes(request):
+            users = [
+                {k: v for k, v in user.items() if k != "enrollments"} for user in users
+            ]
+        return self.paginate(request, users)
+
+    def list_groups(self, request):
+        groups = self.course.groups
+        if "users" not in self.includes(request):
+            groups = [{k: v for k, v in g.items() if k != "users"} for g in groups]
+        return self.paginate(request, groups)
+
+    def list_categories(self, request):
+        return self.paginate(request, self.course.categories)
+
+    # Files
+
+    def list_files(self, request):
+        return self.paginate(request, self.course.files)
+
+    def upload_token(self, request):
+        name = request["form"].get("name", "file")
+        return self.ok(
+            {
+                "upload_url": f"{self.base_url}/files_api/upload",
+                "upload_params": {"filename": name},
+            }
+        )
+
+    def upload_file(self, request):
+        file_id = next(self.course.ids)
+        data = {
+            "id": file_id,
+            "display_name": f"file-{file_id}",
+            "url": f"{self.base_url}/files/{file_id}/download",
+        }
+        self.course.files.append(data)
+        return self.ok(data, 201)
+
+    # Pages and modules
+
+    def edit_front_page(self, request):
+        self.course.front_page = {**request["form"].get("wiki_page", {}), "url": "home"}
+        return self.ok(self.course.front_page)
+
+    def list_pages(self, request):
+        pages = [{k: v for k, v in p.items() if k != "body"} for p in self.course.pages]
+        return self.paginate(request, pages)
+
+    def create_page(self, request):
+        data = request["form"].get("wiki_page", {})
+        url = re.sub(r"[^\w]+", "-", data.get("title", "page").lower()).strip("-")
+        page = {"page_id": next(self.course.ids), "url": url, **data}
+        self.course.pages.append(page)
+        return self.ok(page)
+
+    def edit_page(self, request):
+        page = self.find(self.course.pages, "url", request["url"])
+        if page is None:
+            return self.ok({"errors": []}, 404)
+        page.update(request["form"].get("wiki_page", {}))
+        return self.ok(page)
+
+    def list_modules(self, request):
+        return self.paginate(request, self.course.modules)
+
+    def create_module(self, request):
+        module = {"id": next(self.course.ids), **request["form"].get("module", {})}
+        module["position"] = len(self.course.modules) + 1
+        self.course.modules.append(module)
+        self.course.module_items[module["id"]] = []
+        return self.ok(module)
+
+    def edit_module(self, request):
+        module = self.find(self.course.modules, "id", request["id"])
+        module.update(request["form"].get("module", {}))
+        return self.ok(module)
+
+    def list_items(self, request):
+        return self.paginate(request, self.course.module_items[int(request["id"])])
+
+    def create_item(self, request):
+        data = request["form"].get("module_item", {})
+        page = self.find(self.course.pages, "url", data.get("page_url"))
+        item = {
+            "id": next(self.course.ids),
+            "module_id": int(request["id"]),
+            "title": page["title"] if page else data.get("page_url"),
+            **data,
+        }
+        self.course.module_items[int(request["id"])].append(item)
+        return self.ok(item)
+
+    # Assignments, overrides and submissions
+
+    def list_assignment_groups(self, request):
+        return self.paginate(request, self.course.assignment_groups)
+
+    def create_assignment_group(self, request):
+        group = {"id": next(self.course.ids), "name": request["form"].get("name")}
+        self.course.assignment_groups.append(group)
+        return self.ok(group)
+
+    def list_assignments(self, request):
+        return self.paginate(request, self.course.assignments)
+
+    def create_assignment(self, request):
+        assignment = {
+            "id": next(self.course.ids),
+            "course_id": COURSE_ID,
+            **request["form"].get("assignment", {}),
+        }
+        self.course.assignments.append(assignment)
+        self.course.overrides[assignment["id"]] = []
+        return self.ok(assignment)
+
+    def get_assignment(self, request):
+        assignment = self.find(self.course.assignments, "id", request["id"])
+        if assignment is None:
+            return self.ok({"errors": []}, 404)
+        return self.ok(assignment)
+
+    def edit_assignment(self, request):
+        assignment = self.find(self.course.assignments, "id", request["id"])
+        assignment.update(request["form"].get("assignment", {}))
+        return self.ok(assignment)
+
+    def list_overrides(self, request):
+        return self.paginate(request, self.course.overrides[int(request["id"])])
+
+    def clean_override(self, data):
+        override = {k: (v or None) for k, v in data.items()}
+        override["assignment_id"] = int(override["assignment_id"])
+        if "student_ids" in override:
+            override["student_ids"] = [int(id) for id in override["student_ids"]]
+        if override.get("group_id") is not None:
+            override["group_id"] = int(override["group_id"])
+        return override
+
+    def update_overrides(self, request):
+        updated = []
+        for data in parse_batch(request["pairs"], "assignment_overrides"):
+            data = self.clean_override(data)
+            overrides = self.course.overrides[data["assignment_id"]]
+            override = self.find(overrides, "id", data["id"])
+            override.update({**data, "id": override["id"]})
+            updated.append(override)
+        return self.ok(updated)
+
+    def create_overrides(self, request):
+        created = []
+        for data in parse_batch(request["pairs"], "assignment_overrides"):
+            override = {"id": next(self.course.ids), **self.clean_override(data)}
+            self.course.overrides[override["assignment_id"]].append(override)
+            created.append(override)
+        return self.ok(created)
+
+    def delete_override(self, request):
+        overrides = self.course.overrides[int(request["id"])]
+        override = self.find(overrides, "id", request["override"])
+        overrides.remove(override)
+        return self.ok(override)
+
+    def list_submissions(self, request):
+        submissions = list(self.course.submissions.get(int(request["id"]), {}).values())
+        if "rubric_assessment" not in self.includes(request):
+            submissions = [
+                {k: v for k, v in s.items() if k != "rubric_assessment"}
+                for s in submissions
+            ]
+        return self.paginate(request, submissions)
+
+    def update_grades(self, request):
+        submissions = self.course.submissions[int(request["id"])]
+        for user_id, data in request["form"].get("grade_data", {}).items():
+            submission = submissions[int(user_id)]
+            for criterion, assessment in data.get("rubric_assessment", {}).items():
+                submission["rubric_assessment"][criterion] = {
+                    "rating_id": assessment.get("rating_id"),
+                    "comments": assessment.get("comments", ""),
+                    "points": float(assessment["points"]),
+                }
+            submission["score"] = sum(
+                a["points"] for a in submission["rubric_assessment"].values()
+            )
+        progress = {
+            "id": next(self.course.ids),
+            "workflow_state": "completed",
+            "completion": 100,
+        }
+        progress["url"] = f"{self.base_url}/api/v1/progress/{progress['id']}"
+        self.course.progress[progress["id"]] = progress
+        return self.ok(progress)
+
+    def get_progress(self, request):
+        return self.ok(self.course.progress[int(request["id"])])
+
+    # Rubrics
+
+    def list_rubrics(self, request):
+        return self.paginate(request, self.course.rubrics)
+
+    def create_rubric(self, request):
+        data = request["form"].get("rubric", {})
+        rubric = {"id": next(self.course.ids), "title": data.get("title")}
+        self.course.rubrics.append(rubric)
+        return self.ok({"rubric": rubric})
+
+    def create_rubric_association(self, request):
+        data = request["form"].get("rubric_association", {})
+        return self.ok({"id": next(self.course.ids), **data})
+
+    # Discussions
+
+    def list_announcements(self, request):
+        announcements = [t for t in self.course.topics if t.get("is_announcement")]
+        announcements = [
+            {**t, "context_code": f"course_{COURSE_ID}"} for t in announcements
+        ]
+        return self.paginate(request, announcements)
+
+    def list_topics(self, request):
+        topics = [t for t in self.course.topics if not t.get("is_announcement")]
+        return self.paginate(request, topics)
+
+    def create_topic(self, request):
+        topic = {"id": next(self.course.ids), **request["form"]}
+        topic["is_announcement"] = topic.get("is_announcement") in ("True", "true")
+        self.course.topics.append(topic)
+        self.course.entries[topic["id"]] = []
+        return self.ok(topic)
+
+    def edit_topic(self, request):
+        topic = self.find(self.course.topics, "id", request["id"])
+        topic.update(request["form"])
+        return self.ok(topic)
+
+    def topic_view(self, request):
+        view = self.course.entries.get(int(request["id"]), [])
+        participants = {}
+        stack = list(view)
+        while stack:
+            entry = stack.pop()
+            participants[entry["user_id"]] = {"id": entry["user_id"]}
+            stack.extend(entry["replies"])
+        return self.ok(
+            {
+                "participants": list(participants.values()),
+                "unread_entries": [],
+                "forced_entries": [],
+                "view": view,
+                "new_entries": [],
+            }
+        )
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment, or delayed ACKs stall every response
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def respond(self):
+        started = time.perf_counter()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        canvas = self.server.canvas
+        status, headers, payload, endpoint = canvas.handle(
+            self.command, self.path, body
+        )
+        if canvas.latency:
+            time.sleep(canvas.latency)
+        data = json.dumps(payload).encode("utf-8")
+        if self.command == "GET" and status == 200:
+            # Like Rails, tag GET responses and answer 304 when they match
+            headers = {**headers, "ETag": f'W/"{hashlib.md5(data).hexdigest()}"'}
+            if self.headers.get("If-None-Match") == headers["ETag"]:
+                status, data = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Rate-Limit-Remaining", "700.0")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        canvas.record(
+            {
+                "method": self.command,
+                "endpoint": endpoint,
+                "status": status,
+                "request_bytes": len(self.path) + length,
+                "response_bytes": len(data),
+                "latency": time.perf_counter() - started,
+            }
+        )
+
+    do_GET = do_POST = do_PUT = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(course: Course, latency=0.0, port=0) -> ThreadingHTTPServer:
+    """Start the mock Canvas on a background thread; server.canvas holds its state."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.canvas = MockCanvas(course, latency)
+    server.canvas.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,263 @@
+"""Run kannwas commands against the mock Canvas and report what they cost.
+
+    python benchmarks/run.py [--latency 0.01] [--scenario roster] [--update-baseline]
+
+Every scenario runs the real CLI in a subprocess inside a generated course
+directory. The run fails if a scenario's request count exceeds the one in
+benchmarks/baseline.json, or if its command fails.
+"""
+
+from pathlib import Path
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from mock_canvas import COURSE_ID, Course, RUBRIC, serve
+
+
+BENCHMARKS = Path(__file__).resolve().parent
+BASELINE = BENCHMARKS / "baseline.json"
+
+# Scenarios run in this order against the same server, so publish (warm)
+# republishes what publish (cold) created
+SCENARIOS = {
+    "publish (cold)": ["publish"],
+    "publish (warm)": ["publish"],
+    "roster": ["roster", "--output", "roster.csv"],
+    "discussions": ["discussions", "--output", "discussions.csv"],
+    "due (export)": ["due", "-a", "1"],
+    "due (import)": ["due", "-a", "1", "-i", "extensions-input.csv"],
+    "moderate (export)": ["moderate", "-a", "1"],
+    "moderate (import)": ["moderate", "-a", "1", "-i", "moderation-input.csv"],
+}
+
+
+def write(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def generate_course(root: Path, canvas_url: str, pages=200, assignments=50, topics=20):
+    """Write a course template with the given number of pages, assignments and
+    discussion topics, plus input files for the due and moderate imports."""
+    lms = root / "lms"
+    write(lms / "templates" / "footer.html", "<p>${canvas_page_id} week ${week}</p>\n")
+    for n in range(10):
+        (lms / "images").mkdir(parents=True, exist_ok=True)
+        (lms / "images" / f"figure-{n}.png").write_bytes(bytes([n]) * 2048)
+    write(
+        lms / "home.md",
+        "---\ntitle: Home\npublished: true\n---\n## Welcome\n\nBenchmark course.\n",
+    )
+
+    modules = {}
+    for n in range(pages):
+        week = n // 10 + 1
+        page = f"pages/week-{week:02}-{n % 10 + 1:02}.md"
+        modules.setdefault(
+            f"week{week}", {"title": f"Week {week}", "published": True, "pages": []}
+        )["pages"].append(page)
+        write(
+            lms / page,
+            f"---\ntitle: Week {week} Page {n % 10 + 1}\npublished: true\nweek: {week}\n---\n"
+            f"## Reading {n}\n\n"
+            + "Some *course* content with a [link](https://example.com).\n\n" * 20
+            + f"![Figure](images/figure-{n % 10}.png)\n\n"
+            + '<%include file="footer.html"/>\n',
+        )
+
+    discussions = []
+    for n in range(topics):
+        path = f"discussions/topic-{n + 1:02}.md"
+        discussions.append(path)
+        write(
+            lms / path, f"---\ntitle: Discussion {n + 1}\n---\nDiscuss topic {n + 1}.\n"
+        )
+
+    group = []
+    for n in range(assignments):
+        path = f"assignments/assignment-{n + 1:02}.md"
+        group.append(path)
+        rubric = "".join(
+            f"  - description: {criterion['description']}\n    max_points: 25\n"
+            for criterion in RUBRIC
+        )
+        write(
+            lms / path,
+            f"---\nname: Assignment {n + 1}\npublished: true\n"
+            f"due_at: 2025-04-{n % 28 + 1:02}T23:59:00Z\nrubric:\n{rubric}---\n"
+            f"## Instructions\n\nComplete task {n + 1}.\n",
+        )
+
+    config = {
+        "canvas_url": canvas_url,
+        "canvas_page_id": COURSE_ID,
+        "week_1": "2025-02-24",
+        "frontpage": "home.md",
+        "modules": modules,
+        "discussions": discussions,
+        "assignments": {"assessments": {"title": "Assessments", "assignments": group}},
+    }
+    # JSON is valid YAML and needs no extra dependency here. week_1 goes
+    # unquoted, so YAML reads it as a date like in a real lms.yml
+    yml = json.dumps(config, indent=1)
+    write(lms / "lms.yml", yml.replace('"2025-02-24"', "2025-02-24"))
+
+    extensions = ["id,due_at,lock_at,unlock_at"]
+    for n in range(300):
+        extensions.append(
+            f"{10000 + n * 3},2025-03-{26 + n % 5}T23:59:00Z,2025-04-05T23:59:00Z,"
+            "2025-02-24T00:00:00Z"
+        )
+    write(root / "extensions-input.csv", "\n".join(extensions) + "\n")
+
+    criteria = [criterion["description"] for criterion in RUBRIC]
+    moderation = [",".join(["id", *criteria])]
+    for n in range(200):
+        moderation.append(",".join([str(10000 + n * 7), *["20"] * len(criteria)]))
+    write(root / "moderation-input.csv", "\n".join(moderation) + "\n")
+
+
+def summarize(records, wall_time, returncode) -> dict:
+    latencies = sorted(record["latency"] for record in records)
+    endpoints = {}
+    for record in records:
+        endpoints[record["endpoint"]] = endpoints.get(record["endpoint"], 0) + 1
+    return {
+        "requests": len(records),
+        "request_bytes": sum(record["request_bytes"] for record in records),
+        "response_bytes": sum(record["response_bytes"] for record in records),
+        "errors": sum(1 for record in records if record["status"] >= 400),
+        "wall_time": round(wall_time, 3),
+        "latency_p50": round(statistics.median(latencies), 4) if latencies else 0,
+        "latency_p95": (
+            round(latencies[int(0.95 * (len(latencies) - 1))], 4) if latencies else 0
+        ),
+        "returncode": returncode,
+        "endpoints": dict(sorted(endpoints.items(), key=lambda item: -item[1])),
+    }
+
+
+def run_scenario(server, root: Path, args, verbose) -> dict:
+    env = {
+        **os.environ,
+        "CANVAS_API_KEY": "benchmark",
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(BENCHMARKS.parent), os.environ.get("PYTHONPATH")])
+        ),
+    }
+    server.canvas.reset()
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", "from kannwas.cli import cli; cli()", *args],
+        cwd=root,
+        env=env,
+        capture_output=not verbose,
+        text=True,
+    )
+    wall_time = time.perf_counter() - started
+    if result.returncode != 0 and not verbose:
+        click.echo(result.stdout + result.stderr, err=True)
+    return summarize(server.canvas.reset(), wall_time, result.returncode)
+
+
+def print_table(results, baseline):
+    click.echo(
+        f"{'scenario':<20} {'requests':>9} {'baseline':>9} {'sent':>10} "
+        f"{'received':>11} {'wall (s)':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}"
+    )
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get("requests", "-")
+        click.echo(
+            f"{name:<20} {result['requests']:>9} {expected:>9} "
+            f"{result['request_bytes']:>10} {result['response_bytes']:>11} "
+            f"{result['wall_time']:>9.2f} {result['latency_p50'] * 1000:>9.1f} "
+            f"{result['latency_p95'] * 1000:>9.1f}"
+        )
+
+
+@click.command()
+@click.option(
+    "--latency",
+    default=0.0,
+    type=float,
+    help="Seconds the mock Canvas waits before each response",
+)
+@click.option(
+    "--scenario",
+    "-s",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(list(SCENARIOS)),
+    help="Run only these scenarios (default: all)",
+)
+@click.option("--students", default=2000, help="Number of students in the course")
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Also write the results as JSON to this file",
+)
+@click.option(
+    "--update-baseline",
+    is_flag=True,
+    help="Record these request counts as the new baseline",
+)
+@click.option("--verbose", "-v", is_flag=True, help="Show the commands' output")
+def main(latency, scenarios, students, output, update_baseline, verbose):
+    """Benchmark kannwas commands against a local mock Canvas."""
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    server = serve(Course(students=students), latency)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="kannwas-bench-") as tmp:
+        root = Path(tmp)
+        generate_course(root, server.canvas.base_url)
+        for name, args in SCENARIOS.items():
+            if scenarios and name not in scenarios:
+                continue
+            click.echo(f"Running {name}: kannwas {' '.join(args)}")
+            results[name] = run_scenario(server, root, args, verbose)
+    server.shutdown()
+
+    print_table(results, baseline)
+    if output:
+        Path(output).write_text(json.dumps(results, indent=1))
+
+    failures = []
+    for name, result in results.items():
+        if result["returncode"] != 0:
+            failures.append(f"{name}: command exited with {result['returncode']}")
+        expected = baseline.get(name, {}).get("requests")
+        if not update_baseline and expected is not None:
+            if result["requests"] > expected:
+                failures.append(
+                    f"{name}: {result['requests']} requests, baseline {expected}"
+                )
+
+    if update_baseline and not failures:
+        baseline.update(
+            {
+                name: {
+                    "requests": result["requests"],
+                    "endpoints": result["endpoints"],
+                }
+                for name, result in results.items()
+            }
+        )
+        BASELINE.write_text(json.dumps(baseline, indent=1, sort_keys=True) + "\n")
+        click.echo(f"Baseline written to {BASELINE}")
+
+    for failure in failures:
+        click.echo(f"Regression: {failure}", err=True)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,170 @@
+import time
 import pandas as pd
-import copy
 from canvasapi.exceptions import ResourceDoesNotExist
 
-from kannwas.roster import getStudents
+from kannwas.requester import paginate
+from kannwas.roster import getStudents, streamStudents
+from kannwas.util import write_csv
 
 def getGroups(course):
-    groups = course.get_groups()
+    groups = paginate(course.get_groups())
     return {group.name: group.id for group in groups}
 
-def updateDueDates(course, assignment, _input):
+OVERRIDE_DATES = ['due_at', 'lock_at', 'unlock_at']
+
+EXTENSION_COLUMNS = ['id', 'sid', 'unikey', 'group', *OVERRIDE_DATES]
+
+# Canvas accepts at most this many overrides per batch request
+OVERRIDE_BATCH_SIZE = 50
+
+
+def normalizeDate(value) -> str | None:
+    if value is None or pd.isna(value):
+        return None
+    return pd.to_datetime(value, utc=True).isoformat()
+
+
+def overrideData(override) -> dict:
+    """Return the comparable fields of an existing assignment override."""
+    data = {
+        date: normalizeDate(getattr(override, date, None)) for date in OVERRIDE_DATES
+    }
+    if getattr(override, 'group_id', None) is not None:
+        data['group_id'] = override.group_id
+    if getattr(override, 'student_ids', None) is not None:
+        data['student_ids'] = sorted(int(id) for id in override.student_ids)
+        data['title'] = override.title
+    return data
+
+
+def desiredOverrides(course, df) -> list[dict]:
+    if 'group' in df.columns:
+        group_mapping = getGroups(course)
+        return [
+            {
+                'group_id': group_mapping[row.group],
+                **{date: normalizeDate(row[date]) for date in OVERRIDE_DATES}
+            }
+            for _, row in df.iterrows()
+        ]
+    if 'id' in df.columns:
+        # Keep the students whose override leaves a date empty
+        grouped = df.groupby(OVERRIDE_DATES, dropna=False).agg({
+            'id': lambda x: sorted(x.astype(int).tolist())
+        }).reset_index()
+        return [
+            {
+                'student_ids': row.id,
+                'title': f'extension-{index}',
+                **{date: normalizeDate(row[date]) for date in OVERRIDE_DATES}
+            }
+            for index, row in grouped.iterrows()
+        ]
+    return []
+
+
+def diffOverrides(existing, desired):
+    """Match the desired overrides to the existing ones.
+
+    Group overrides match on their group, student overrides on their dates.
+    Leftover student overrides are reused for leftover desired ones rather
+    than deleted and recreated. Returns (creates, updates, deletes) where
+    updates are (override, data) pairs.
+    """
+    def key(data):
+        if 'group_id' in data:
+            return ('group', data['group_id'])
+        if 'student_ids' in data:
+            return ('students', *(data[date] for date in OVERRIDE_DATES))
+        return None
+
+    unmatched = {}
+    for override in existing:
+        unmatched.setdefault(key(overrideData(override)), []).append(override)
+    updates, creates = [], []
+    for data in desired:
+        candidates = unmatched.get(key(data))
+        if candidates:
+            override = candidates.pop(0)
+            current = overrideData(override)
+            if 'title' in current:
+                data = {**data, 'title': current['title']}
+            if current != data:
+                updates.append((override, data))
+        else:
+            creates.append(data)
+    leftovers = [
+        override for overrides in unmatched.values() for override in overrides
+    ]
+    reusable = [o for o in leftovers if getattr(o, 'student_ids', None) is not None]
+    for data in [data for data in creates if 'student_ids' in data]:
+        if not reusable:
+            break
+        override = reusable.pop(0)
+        leftovers.remove(override)
+        creates.remove(data)
+        updates.append((override, data))
+    return creates, updates, leftovers
+
+
+def overridePayload(assignment_id, data) -> dict:
+    """Return override data as sent to the batch override endpoints.
+
+    requests leaves None out of the form, and Canvas keeps the dates it isn't
+    sent, so cleared dates go as empty strings.
+    """
+    return {
+        'assignment_id': assignment_id,
+        **data,
+        **{date: '' for date in OVERRIDE_DATES if date in data and data[date] is None},
+    }
+
+
+def getAssignment(course, assignment):
+    """Get an assignment by id, or by its exact name since ids differ
+    between the courses a command runs for."""
+    if str(assignment).isdigit():
+        return course.get_assignment(assignment)
+    for candidate in paginate(course.get_assignments(search_term=assignment)):
+        if candidate.name == assignment:
+            return candidate
+    raise ResourceDoesNotExist(f"No assignment named {assignment!r} in course {course.id}")
+
+
+def updateDueDates(course, assignment, _input, output="extensions.csv"):
     if _input:
-        assignment = course.get_assignment(assignment)
-        overrides = assignment.get_overrides()
-        for override in overrides:
-            override.delete()
+        assignment = getAssignment(course, assignment)
         df = pd.read_csv(_input)
+        desired = desiredOverrides(course, df)
+        creates, updates, deletes = diffOverrides(
+            list(paginate(assignment.get_overrides())), desired
+        )
+        unchanged = len(desired) - len(creates) - len(updates)
+        print(
+            f"Overrides: {len(creates)} to create, {len(updates)} to update, "
+            f"{len(deletes)} to delete, {unchanged} unchanged"
+        )
 
-        if 'group' in df.columns:
-            group_mapping = getGroups(course)
-            for _, row in df.iterrows():
-                assignment_override = {
-                    'group_id': group_mapping[row.group],
-                    'due_at': row['due_at'],
-                    'lock_at': row['lock_at'],
-                    'unlock_at': row['unlock_at']
-                }
-                assignment.create_override(assignment_override=assignment_override)
-            return
-        
-        if 'id' in df.columns:
-            grouped = df.groupby(['due_at', 'lock_at', 'unlock_at']).agg({
-                'id': lambda x: x.astype(str).tolist()
-            }).reset_index()
-            for index, row in grouped.iterrows():
-                assignment_override = {
-                    'student_ids': row.id,
-                    'title': f'extension-{index}',
-                    'due_at': row['due_at'],
-                    'lock_at': row['lock_at'],
-                    'unlock_at': row['unlock_at']
-                }
-                assignment.create_override(assignment_override=assignment_override)
-            return
+        # There is no batch delete, but deletes go first so students can move
+        # between overrides in the batched updates and creates
+        for override in deletes:
+            override.delete()
+        updates = [
+            {'id': override.id, **overridePayload(assignment.id, data)}
+            for override, data in updates
+        ]
+        creates = [overridePayload(assignment.id, data) for data in creates]
+        for start in range(0, len(updates), OVERRIDE_BATCH_SIZE):
+            batch = updates[start:start + OVERRIDE_BATCH_SIZE]
+            list(course.update_assignment_overrides(batch))
+        for start in range(0, len(creates), OVERRIDE_BATCH_SIZE):
+            batch = creates[start:start + OVERRIDE_BATCH_SIZE]
+            list(course.create_assignment_overrides(batch))
     else:
-        assignment = course.get_assignment(assignment)
-        students = getStudents(course)
-        export = []
-        for student in students:
-            export.append({
+        assignment = getAssignment(course, assignment)
+        _, students = streamStudents(course)
+        rows = (
+            {
                 "id": student.id,
                 "sid": student.sid,
                 "unikey": student.unikey,
@@ -55,69 +172,131 @@ def updateDueDates(course, assignment, _input):
                 "due_at": assignment.due_at,
                 "lock_at": assignment.lock_at,
                 "unlock_at": assignment.unlock_at
-            })
-        df = pd.DataFrame(export)
-        df.to_csv("extensions.csv", index=False)
+            }
+            for student in students
+        )
+        write_csv(output, EXTENSION_COLUMNS, rows)
+
+
+def getRubricChanges(rubric, submission, row) -> dict | None:
+    """Apply a moderation row to a submission's rubric assessment.
+
+    Returns the new rubric assessment, or None if no points changed.
+    """
+    current = getattr(submission, "rubric_assessment", None) or {}
+    rubric_assessment = {}
+    changed = False
+    for criterion in rubric:
+        old = current.get(
+            criterion["id"], {"rating_id": None, "comments": "", "points": 0.0}
+        )
+        new = {key: value for key, value in old.items() if value is not None}
+        points = row.get(criterion["description"])
+        if points is not None and not pd.isna(points):
+            new["points"] = float(points)
+            changed = changed or new["points"] != old.get("points")
+        rubric_assessment[criterion["id"]] = new
+    return rubric_assessment if changed else None
+
+
+def waitForProgress(progress, interval=1.0):
+    while progress.workflow_state in ("queued", "running"):
+        time.sleep(interval)
+        progress = progress.query()
+    return progress
+
+
+def getFailedUpdates(assignment, grade_data) -> list:
+    """Return the students whose rubric points do not match grade_data on Canvas."""
+    submissions = paginate(assignment.get_submissions(include=["rubric_assessment"]))
+    current = {
+        submission.user_id: getattr(submission, "rubric_assessment", None) or {}
+        for submission in submissions
+    }
+    failed = []
+    for user_id, data in grade_data.items():
+        for criterion_id, assessment in data["rubric_assessment"].items():
+            # Criteria unscored on Canvas and blank in the input were not sent
+            expected = assessment.get("points")
+            if expected is None:
+                continue
+            points = current.get(user_id, {}).get(criterion_id, {}).get("points")
+            if points != expected:
+                failed.append(user_id)
+                break
+    return failed
+
+
+STUDENT_COLUMNS = ["sid", "name", "unikey", "email", "section", "group"]
+
+
+def moderationRow(rubric, submission, student) -> dict:
+    """Return a moderation export row: id, student details, criteria, total."""
+    row = {"id": submission.user_id}
+    for column in STUDENT_COLUMNS:
+        row[column] = getattr(student, column) if student else None
+    assessment = getattr(submission, "rubric_assessment", None)
+    for item in rubric:
+        row[item["description"]] = (
+            assessment.get(item["id"], {}).get("points") if assessment else None
+        )
+    row["total"] = submission.score
+    return row
 
 
 def adjustMarks(course, assignment, _input):
     if _input:
         df = pd.read_csv(_input)
         assignment = course.get_assignment(assignment)
+        submissions = {
+            submission.user_id: submission
+            for submission in paginate(
+                assignment.get_submissions(include=["rubric_assessment"])
+            )
+        }
+        grade_data = {}
+        failures = {}
         for _, row in df.iterrows():
-            try:
-                submission = assignment.get_submission(row["id"], include=["rubric_assessment"])
-                if not hasattr(submission, "rubric_assessment"):
-                    rubric_assessment = {
-                        item["id"]: {"rating_id": None, "comments": "", "points": 0.0}
-                        for item in assignment.rubric
-                    }
-                    rubric_assessment_old = copy.deepcopy(rubric_assessment)
-                else:
-                    rubric_assessment_old = copy.deepcopy(submission.rubric_assessment)
-                    rubric_assessment = submission.rubric_assessment
-                for criterion in assignment.rubric:
-                    if criterion["description"] in row:
-                        rubric_assessment[criterion["id"]]["points"] = row[criterion["description"]]
-                if rubric_assessment_old != rubric_assessment:
-                    submission.edit(rubric_assessment=rubric_assessment)
-            except ResourceDoesNotExist:
+            user_id = int(row["id"])
+            submission = submissions.get(user_id)
+            if submission is None:
+                failures[user_id] = "no submission"
                 continue
+            rubric_assessment = getRubricChanges(assignment.rubric, submission, row)
+            if rubric_assessment is not None:
+                grade_data[user_id] = {"rubric_assessment": rubric_assessment}
+
+        if grade_data:
+            print(f"Updating {len(grade_data)} submissions")
+            progress = waitForProgress(
+                assignment.submissions_bulk_update(grade_data=grade_data)
+            )
+            if progress.workflow_state == "failed":
+                print(f"Bulk update failed: {getattr(progress, 'message', '')}")
+            # The progress only reports on the whole job, so check each student
+            for user_id in getFailedUpdates(assignment, grade_data):
+                failures[user_id] = "marks not updated"
+        else:
+            print("No marks changed")
+
+        for user_id, reason in failures.items():
+            print(f"  Failed: {user_id} ({reason})")
+        print(f"{len(grade_data)} submissions changed, {len(failures)} failed")
     else:
         assignment = course.get_assignment(assignment)
-        submissions = assignment.get_submissions(include=["rubric_assessment"])
-        export = []
-        for submission in submissions:
-            meta = {
-                "id": submission.user_id,
-                "total": submission.score
-            }
-            if hasattr(submission, "rubric_assessment"):
-                rubric_assessment = {
-                    item["description"]: submission.rubric_assessment[item["id"]]["points"]
-                    for item in assignment.rubric
-                }
-            else:
-                rubric_assessment = {item["description"]: None for item in assignment.rubric}
-            meta.update(rubric_assessment)
-            export.append(meta)
-        students = getStudents(course)
-        for item in export:
-            student = next(
-                (student for student in students if student.id == item["id"]), None
+        students = {student.id: student for student in getStudents(course)}
+        criteria = [item["description"] for item in assignment.rubric]
+        submissions = paginate(
+            assignment.get_submissions(include=["rubric_assessment"])
+        )
+        rows = (
+            moderationRow(
+                assignment.rubric, submission, students.get(submission.user_id)
             )
-            student_data = {
-                "sid": student.sid if student else None,
-                "name": student.name if student else None,
-                "unikey": student.unikey if student else None,
-                "email": student.email if student else None,
-                "section": student.section if student else None,
-                "group": student.group if student else None,
-            }
-            item.update(student_data)
-        df = pd.DataFrame(export)
-        df_reordered = df.iloc[:, [0, 6, 7, 8, 9, 10, 11, 2, 3, 4, 5, 1]]
-        df_reordered.to_csv("moderation.csv", index=False)
+            for submission in submissions
+        )
+        columns = ["id", *STUDENT_COLUMNS, *criteria, "total"]
+        write_csv("moderation.csv", columns, rows)
 
 
 if __name__ == "__main__":
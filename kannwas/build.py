@@ -1,13 +1,26 @@
 from pathlib import Path
 from datetime import timedelta
+import contextlib
 import os
 import re
 import shutil
 import tempfile
-import docker
-import yaml
-from mako.template import Template
+import queue
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from kannwas.cache import BuildDatabase, file_hash
+from kannwas.config import LMS_CONFIG, load_config
+from kannwas.templates import get_template, prune_templates
+
+
+ASSESSMENTS_IMAGE = "ghcr.io/re3-work/pandoc-assessments:latest"
+LECTURES_IMAGE = "ghcr.io/re3-work/marp-usbs:latest"
 
 # Placeholder for escaped markdown headings (using a string unlikely to appear in content)
 HEADING_PLACEHOLDER = "__MAKO_SAFE_HASH__"
@@ -31,12 +44,10 @@ def unescape_markdown_headings(content: str) -> str:
 
 def load_week_1():
     """Load week_1 from lms/lms.yml"""
-    lms_path = Path("./lms/lms.yml")
-    if not lms_path.exists():
+    if not LMS_CONFIG.exists():
         return None
-    rendered = Template(filename=lms_path.as_posix()).render()
-    config = yaml.safe_load(rendered)
-    return config.get("week_1")
+    # As YAML parsed it, like the page templates get it
+    return load_config().metadata().get("week_1")
 
 
 def render_assessment_file(file_path: Path, week_1) -> str:
@@ -45,12 +56,128 @@ def render_assessment_file(file_path: Path, week_1) -> str:
         content = f.read()
     # Escape markdown headings before Mako processing to prevent ## being treated as comments
     escaped_content = escape_markdown_headings(content)
-    template = Template(escaped_content)
-    rendered = template.render(week_1=week_1, timedelta=timedelta)
+    rendered = get_template(escaped_content).render(week_1=week_1, timedelta=timedelta)
     # Restore markdown headings after Mako processing
     return unescape_markdown_headings(rendered)
 
 
+def referenced_files(path: Path, base: Path) -> list[Path]:
+    """Return the files under base that are mentioned by path, e.g. images,
+    bibliographies or templates referenced from markdown or YAML."""
+    text = path.read_text(encoding="utf-8", errors="ignore")
+    candidates = set(re.findall(r"[\w./-]+\.[A-Za-z0-9]+", text))
+    return sorted(
+        base / candidate
+        for candidate in candidates
+        if (base / candidate).is_file() and (base / candidate) != path
+    )
+
+
+def input_hashes(files, base: Path) -> dict:
+    return {Path(file).relative_to(base).as_posix(): file_hash(file) for file in files}
+
+
+def get_image_id(client, image):
+    """Return the local id of a Docker image, or None if it hasn't been pulled."""
+    from docker.errors import ImageNotFound
+
+    try:
+        return client.images.get(image).id
+    except ImageNotFound:
+        return None
+
+
+def assessment_inputs(source: Path, week_1, image_id) -> dict:
+    metadata = source.with_suffix(".yml")
+    files = [source, *referenced_files(source, source.parent)]
+    if metadata.exists():
+        files += [metadata, *referenced_files(metadata, source.parent)]
+    return {
+        "files": input_hashes(sorted(set(files)), source.parent),
+        "week_1": str(week_1),
+        "image": image_id,
+    }
+
+
+def deck_inputs(deck: Path, image_id) -> dict:
+    files = [deck, *referenced_files(deck, deck.parent)]
+    return {"files": input_hashes(files, deck.parent), "image": image_id}
+
+
+# Linux ioctl that makes dest share src's blocks copy-on-write (btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def reflink(src: Path, dest: Path):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copystat(src, dest)
+
+
+def is_staged(src: Path, dest: Path) -> bool:
+    """Return True if dest already holds the content of src."""
+    if not dest.exists():
+        return False
+    if os.path.samefile(src, dest):
+        return True
+    src_stat, dest_stat = src.stat(), dest.stat()
+    if src_stat.st_size != dest_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+        return True
+    if file_hash(src) == file_hash(dest):
+        shutil.copystat(src, dest)
+        return True
+    return False
+
+
+def stage_file(src: Path, dest: Path, move: bool = False) -> bool:
+    """Place src at dest as cheaply as the filesystem allows.
+
+    Moves are renames. Copies are reflinks, then hardlinks, then real copies,
+    whichever works first. Returns False if dest was already up to date.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if is_staged(src, dest):
+        if move and not os.path.samefile(src, dest):
+            src.unlink()
+        return False
+    if move:
+        try:
+            os.replace(src, dest)
+            return True
+        except OSError:
+            pass  # Different filesystems, copy and remove below
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    for place in (reflink, os.link, shutil.copy2):
+        try:
+            tmp.unlink(missing_ok=True)
+            place(src, tmp)
+            break
+        except OSError:
+            if place is shutil.copy2:
+                raise
+    os.replace(tmp, dest)
+    if move:
+        src.unlink()
+    return True
+
+
+def stage_files(pairs, move: bool = False, jobs: int = 8) -> int:
+    """Stage (src, dest) pairs in parallel and return how many were placed."""
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return sum(pool.map(lambda pair: stage_file(*pair, move=move), pairs))
+
+
+def tree_pairs(src_dir: Path, dest_dir: Path):
+    for root, _, files in os.walk(src_dir):
+        for file in files:
+            src = Path(root) / file
+            yield src, dest_dir / src.relative_to(src_dir)
+
+
 def copy_files(
     src_dir: Path,
     pattern: str,
@@ -58,23 +185,127 @@ def copy_files(
     move: bool = True,
     dest_subdir: str = None,
 ):
+    pairs = []
     for src_path in src_dir.glob(pattern):
         if dest_subdir is not None:
             dest_path = dest_root / dest_subdir / src_path.relative_to(src_dir)
         else:
             dest_path = dest_root / src_path.relative_to(src_dir.parent)
-        dest_path.parent.mkdir(parents=True, exist_ok=True)
-        if move:
-            src_path.replace(dest_path)
         if src_path.is_file():
-            shutil.copy2(src_path, dest_path)
+            pairs.append((src_path, dest_path))
         elif src_path.is_dir():
-            shutil.copytree(src_path, dest_path, dirs_exist_ok=True)
+            pairs.extend(tree_pairs(src_path, dest_path))
+    stage_files(pairs, move=move)
 
 
-def build_assessments(in_path, build_path):
-    client = docker.from_env()
+class ContainerPool(object):
+    """A few long-lived containers of an image that commands are exec'd in.
+
+    Starting a container costs more than most conversions, so each container
+    is started once, kept idle, and runs the image's entrypoint through exec
+    for every command.
+    """
+
+    def __init__(self, client, image, size, volumes, environment=None):
+        from docker.errors import ImageNotFound
+
+        try:
+            config = client.images.get(image).attrs["Config"]
+        except ImageNotFound:
+            config = client.images.pull(image).attrs["Config"]
+        self.entrypoint = config.get("Entrypoint") or []
+        self.workdir = config.get("WorkingDir") or None
+        self.environment = environment
+        self.containers = queue.Queue()
+        self.started = []
+        try:
+            for _ in range(size):
+                container = client.containers.run(
+                    image=image,
+                    entrypoint=["tail", "-f", "/dev/null"],
+                    auto_remove=True,
+                    detach=True,
+                    volumes=volumes,
+                    environment=environment,
+                )
+                self.started.append(container)
+                self.containers.put(container)
+        except BaseException:
+            # The caller gets no pool to close, and the idle containers never
+            # exit on their own. The error starting them is the one to report
+            with contextlib.suppress(Exception):
+                self.close()
+            raise
+
+    def run(self, command, workdir=None):
+        """Run the entrypoint with command in an idle container.
+
+        Returns the exit code and the combined stdout/stderr output.
+        """
+        return self._exec(self.entrypoint + command, workdir)
+
+    def run_all(self, commands, workdir=None):
+        """Run the entrypoint once per command, in one exec of one container.
+
+        Stops at the first failing command.
+        """
+        script = " && ".join(
+            shlex.join(self.entrypoint + command) for command in commands
+        )
+        return self._exec(["sh", "-c", script], workdir)
+
+    def _exec(self, cmd, workdir):
+        container = self.containers.get()
+        try:
+            result = container.exec_run(
+                cmd,
+                workdir=workdir or self.workdir,
+                environment=self.environment,
+            )
+        finally:
+            self.containers.put(container)
+        return result.exit_code, result.output.decode("utf-8", errors="replace")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Stop every started container, even if stopping one of them fails."""
+        errors = []
+        for container in self.started:
+            try:
+                container.stop(timeout=1)
+            except Exception as e:
+                errors.append(e)
+        self.started = []
+        if errors:
+            raise errors[0]
+
+
+def build_assessments(in_path, build_path, jobs=4) -> list[str]:
+    """Build every changed assessment and return the names of those that failed."""
+    # docker is only needed to build, not to preprocess
+    import docker
+
     week_1 = load_week_1()
+    client = docker.from_env()
+    builds = BuildDatabase(Path("."))
+    image_id = get_image_id(client, ASSESSMENTS_IMAGE)
+    failed = []
+
+    stale = {}
+    for source in sorted(in_path.glob("*.md")):
+        target = build_path / "assessments" / f"{source.stem}.pdf"
+        inputs = assessment_inputs(source, week_1, image_id)
+        if not builds.up_to_date(target, inputs):
+            stale[source.name] = (target, inputs)
+    up_to_date = len(list(in_path.glob("*.md"))) - len(stale)
+    print(f"  {len(stale)} assessment(s) to build, {up_to_date} up to date")
+    if not stale:
+        return failed
 
     # Create temp directory for rendered files
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -94,23 +325,40 @@ def build_assessments(in_path, build_path):
                 else:
                     shutil.copy2(src, dst)
             else:
-                # Copy other files (assets, etc.) as-is
+                # Stage other files (assets, etc.) as-is
                 if src.is_file():
-                    shutil.copy2(src, dst)
+                    stage_file(src, dst)
                 elif src.is_dir():
-                    shutil.copytree(src, dst)
-
-        # Run Pandoc on rendered files
-        for file in os.listdir(temp_path):
-            if file.endswith(".md"):
-                metadata_file = Path(file).with_suffix(".yml")
-                client.containers.run(
-                    image="ghcr.io/re3-work/pandoc-assessments:latest",
-                    auto_remove=True,
-                    detach=False,
-                    volumes=[f"{temp_path.absolute()}:/data/"],
-                    command=[file, "-d", metadata_file.as_posix()],
-                )
+                    stage_files(tree_pairs(src, dst))
+
+        # Run Pandoc on changed files, reusing a few containers for all of them
+        files = list(stale)
+        built = []
+        with (
+            ContainerPool(
+                client,
+                ASSESSMENTS_IMAGE,
+                min(jobs, len(files)),
+                volumes=[f"{temp_path.absolute()}:/data/"],
+            ) as pool,
+            ThreadPoolExecutor(max_workers=jobs) as executor,
+        ):
+            metadata_files = [Path(file).with_suffix(".yml") for file in files]
+            results = executor.map(
+                lambda file, metadata_file: pool.run(
+                    [file, "-d", metadata_file.as_posix()], workdir="/data"
+                ),
+                files,
+                metadata_files,
+            )
+            for file, (exit_code, output) in zip(files, results):
+                if exit_code == 0:
+                    print(f"  Built: {file}")
+                    built.append(file)
+                else:
+                    print(f"  Failed: {file} (exit code {exit_code})")
+                    print(output)
+                    failed.append(file)
 
         # Copy outputs from temp to build
         copy_files(temp_path, "*.pdf", build_path, move=True, dest_subdir="assessments")
@@ -118,53 +366,105 @@ def build_assessments(in_path, build_path):
             temp_path, "*.csv", build_path, move=False, dest_subdir="assessments"
         )
 
+    # The image may have been pulled by the pool, so record its id now
+    image_id = image_id or get_image_id(client, ASSESSMENTS_IMAGE)
+    for file in built:
+        target, inputs = stale[file]
+        builds.record(target, {**inputs, "image": image_id})
+    builds.save()
+    prune_templates()
+    return failed
+
+
+def collect_assets(in_path: Path) -> list[Path]:
+    """Return the images inside every assets directory of in_path in one walk."""
+    assets = []
+    for root, _, files in os.walk(in_path):
+        if Path(root).name == "assets":
+            assets.extend(
+                Path(root) / file for file in files if file.endswith((".png", ".jpg"))
+            )
+    return assets
+
+
+def build_lectures(in_path, html, pdf, build_path, jobs=4) -> list[str]:
+    """Build every changed lecture deck and return the names of those that failed."""
+    import docker
 
-def build_lectures(in_path, html, pdf, build_path):
     client = docker.from_env()
     marp_user = f"{os.getuid()}:{os.getgid()}"
-    if pdf:
-        client.containers.run(
-            image="ghcr.io/re3-work/marp-usbs:latest",
-            auto_remove=True,
-            detach=False,
-            volumes=[f"{in_path.absolute()}:/home/marp/app/"],
-            environment={"MARP_USER": marp_user},
-            command=[
-                "--engine",
-                "/home/marp/core/engine.js",
-                "--theme",
-                "/home/marp/core/usbs.css",
-                "--allow-local-files",
-                "-I",
-                "--pdf",
-                ".",
-            ],
-        )
-        copy_files(in_path, "**/*.pdf", build_path, move=True)
+    builds = BuildDatabase(Path("."))
+    image_id = get_image_id(client, LECTURES_IMAGE)
+    formats = [fmt for fmt, enabled in (("pdf", pdf), ("html", html)) if enabled]
+    failed = []
+
+    # The formats of each deck whose inputs changed since they were last built
+    stale = {}
+    for deck in sorted(in_path.rglob("*.md")):
+        inputs = deck_inputs(deck, image_id)
+        for output_format in formats:
+            target = build_path / deck.relative_to(in_path.parent).with_suffix(
+                f".{output_format}"
+            )
+            if not builds.up_to_date(target, inputs):
+                stale.setdefault(deck, []).append((output_format, target, inputs))
+    print(f"  {len(stale)} lecture(s) to build")
+
+    if stale:
+        # Each deck is built in a single exec producing all of its formats
+        with (
+            ContainerPool(
+                client,
+                LECTURES_IMAGE,
+                min(jobs, len(stale)),
+                volumes=[f"{in_path.absolute()}:/home/marp/app/"],
+                environment={"MARP_USER": marp_user},
+            ) as pool,
+            ThreadPoolExecutor(max_workers=jobs) as executor,
+        ):
+            decks = list(stale)
+            results = executor.map(
+                lambda deck: pool.run_all(
+                    [
+                        [
+                            "--engine",
+                            "/home/marp/core/engine.js",
+                            "--theme",
+                            "/home/marp/core/usbs.css",
+                            "--allow-local-files",
+                            f"--{output_format}",
+                            deck.relative_to(in_path).as_posix(),
+                        ]
+                        for output_format, _, _ in stale[deck]
+                    ],
+                    workdir="/home/marp/app",
+                ),
+                decks,
+            )
+            built = []
+            for deck, (exit_code, output) in zip(decks, results):
+                if exit_code == 0:
+                    print(f"  Built: {deck}")
+                    built.append(deck)
+                else:
+                    print(f"  Failed: {deck} (exit code {exit_code})")
+                    print(output)
+                    failed.append(str(deck))
+
+        for output_format in formats:
+            copy_files(in_path, f"**/*.{output_format}", build_path, move=True)
+        image_id = image_id or get_image_id(client, LECTURES_IMAGE)
+        for deck in built:
+            for _, target, inputs in stale[deck]:
+                builds.record(target, {**inputs, "image": image_id})
+        builds.save()
 
     if html:
-        client.containers.run(
-            image="ghcr.io/re3-work/marp-usbs:latest",
-            auto_remove=True,
-            detach=False,
-            volumes=[f"{in_path.absolute()}:/home/marp/app/"],
-            environment={"MARP_USER": marp_user},
-            command=[
-                "--engine",
-                "/home/marp/core/engine.js",
-                "--theme",
-                "/home/marp/core/usbs.css",
-                "--allow-local-files",
-                "-I",
-                "--html",
-                ".",
-            ],
+        stage_files(
+            (asset, build_path / asset.relative_to(in_path.parent))
+            for asset in collect_assets(in_path)
         )
-        copy_files(in_path, "**/*.html", build_path, move=True)
-        copy_files(in_path, "assets/*.png", build_path, move=False)
-        copy_files(in_path, "**/assets/*.png", build_path, move=False)
-        copy_files(in_path, "assets/*.jpg", build_path, move=False)
-        copy_files(in_path, "**/assets/*.jpg", build_path, move=False)
+    return failed
 
 
 def copy_extras(in_path, build_path):
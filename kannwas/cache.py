@@ -0,0 +1,229 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+# Directory (relative to the course root) that holds kannwas' persistent state
+STATE_DIR = ".kannwas"
+
+
+def state_path(root: Path, name: str) -> Path:
+    """Return the path of a state file inside the course's .kannwas directory."""
+    return Path(root) / STATE_DIR / name
+
+
+def file_hash(path: Path) -> str:
+    """Return the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """Return the sha256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_json(path: Path, default=None):
+    if not path.exists():
+        return {} if default is None else default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"  Warning: Ignoring unreadable cache file: {path}")
+        return {} if default is None else default
+
+
+def save_json(path: Path, data):
+    """Atomically write data as JSON so an interrupted run never corrupts the cache."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# Serializes saves of the per-course state files between concurrent publishes
+_save_lock = threading.Lock()
+
+
+def save_course_entries(path: Path, course_id, entries):
+    """Save one course's entries of a per-course state file, keeping the
+    entries other courses saved since it was loaded."""
+    with _save_lock:
+        data = load_json(path)
+        data[str(course_id)] = entries
+        save_json(path, data)
+
+
+class UploadCache(object):
+    """Map file content hashes to Canvas file ids so unchanged files are not re-uploaded.
+
+    Entries are stored per course in .kannwas/uploads.json. Before the first
+    upload, the course's file list is fetched once and the entries loaded from
+    disk whose files were deleted on Canvas are dropped. Concurrent uploads of
+    the same content wait for the first one instead of uploading it twice.
+    """
+
+    def __init__(self, course, root: Path):
+        self.course = course
+        self.path = state_path(root, "uploads.json")
+        self.entries = load_json(self.path).get(str(course.id), {})
+        self.validated = False
+        self.hits = 0
+        self.misses = 0
+        # Guards entries and the counters
+        self._lock = threading.Lock()
+        self._file_locks = {}
+
+    def _validate(self):
+        existing = {str(file.id) for file in self.course.get_files()}
+        stale = [
+            digest
+            for digest, file_id in self.entries.items()
+            if str(file_id) not in existing
+        ]
+        for digest in stale:
+            del self.entries[digest]
+        if stale:
+            print(f"  Dropped {len(stale)} cached upload(s) deleted on Canvas")
+
+    def upload(self, path: Path) -> int:
+        """Return the Canvas file id for path, uploading it only if its content is new."""
+        digest = file_hash(path)
+        with self._lock:
+            # Holding the lock, no upload of this run can start before the
+            # entries loaded from disk are validated
+            if not self.validated:
+                if self.entries:
+                    self._validate()
+                self.validated = True
+            file_lock = self._file_locks.setdefault(digest, threading.Lock())
+        with file_lock:
+            with self._lock:
+                file_id = self.entries.get(digest)
+                if file_id is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if file_id is not None:
+                print(f"  Reusing: {path}")
+                return file_id
+            print(f"  Uploading: {path}")
+            file = self.course.upload(path)
+            with self._lock:
+                self.entries[digest] = file[1]["id"]
+            return file[1]["id"]
+
+    def save(self):
+        save_course_entries(self.path, self.course.id, self.entries)
+
+    def summary(self) -> str:
+        return f"Uploads: {self.hits} reused, {self.misses} uploaded"
+
+
+def payload_hash(payload) -> str:
+    return text_hash(json.dumps(payload, sort_keys=True, default=str))
+
+
+class Manifest(object):
+    """Record a hash of the last payload sent for each Canvas object.
+
+    Entries are stored per course in .kannwas/manifest.json and keyed by object
+    kind and title, e.g. "page:Week 1". An edit whose payload hashes the same as
+    the recorded one can be skipped. With force=True nothing is considered
+    unchanged, but the manifest is still refreshed.
+    """
+
+    def __init__(self, course, root: Path, force: bool = False):
+        self.path = state_path(root, "manifest.json")
+        self.course_id = course.id
+        self.entries = load_json(self.path).get(str(course.id), {})
+        self.force = force
+        self.skipped = []
+        self.updated = []
+
+    def unchanged(self, key: str, payload) -> bool:
+        if not self.force and self.entries.get(key) == payload_hash(payload):
+            self.skipped.append(key)
+            return True
+        return False
+
+    def record(self, key: str, payload):
+        self.entries[key] = payload_hash(payload)
+        self.updated.append(key)
+
+    def save(self):
+        save_course_entries(self.path, self.course_id, self.entries)
+
+    def summary(self) -> str:
+        lines = [f"Updated {len(self.updated)}, skipped {len(self.skipped)} unchanged"]
+        lines.extend(f"  Updated: {key}" for key in self.updated)
+        return "\n".join(lines)
+
+
+class ContentCache(object):
+    """Persistent map from a content hash to a value derived from that content.
+
+    Used to memoize expensive conversions across runs, e.g. HTML to Markdown.
+    Entries are stored in .kannwas/<name>.sqlite and looked up one at a time,
+    so the cache is never loaded into memory as a whole.
+    """
+
+    def __init__(self, root: Path, name: str):
+        path = state_path(root, f"{name}.sqlite")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def get(self, content: str):
+        row = self.db.execute(
+            "SELECT value FROM entries WHERE key = ?", (text_hash(content),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, content: str, value):
+        # Entries are keyed by content, so concurrent runs can't conflict
+        self.db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+            (text_hash(content), json.dumps(value)),
+        )
+
+    def save(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class BuildDatabase(object):
+    """Record, for each build output, a hash of the inputs it was built from.
+
+    Stored in .kannwas/build.json. A target is up to date if it exists and its
+    inputs hash the same as when it was last built.
+    """
+
+    def __init__(self, root: Path):
+        self.path = state_path(root, "build.json")
+        self.entries = load_json(self.path)
+
+    def up_to_date(self, target: Path, inputs) -> bool:
+        recorded = self.entries.get(Path(target).as_posix())
+        return Path(target).exists() and recorded == payload_hash(inputs)
+
+    def record(self, target: Path, inputs):
+        self.entries[Path(target).as_posix()] = payload_hash(inputs)
+
+    def save(self):
+        save_json(self.path, self.entries)
@@ -1,60 +1,242 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import timedelta
 import shutil
 import subprocess
 import click
 import os
-from canvasapi import Canvas
-import yaml
-from mako.template import Template
-
-from kannwas.assignment import updateDueDates, adjustMarks
-from kannwas.build import (
-    build_assessments,
-    build_lectures,
-    copy_extras,
-    load_week_1,
-    render_assessment_file,
-)
-from kannwas.discussions import downloadDiscussions
-from kannwas.publish import publish as _publish
-from kannwas.roster import downloadRoster
-from kannwas.util import generate_schedule
-from kannwas.padlet import export_padlet, create_qr_codes, create_html_qr_sections
+
+# The command modules and their dependencies (canvasapi, pandas, docker, mako,
+# ...) are imported by the commands that use them, so every command starts
+# without paying for the others. benchmarks/imports.py keeps it that way
+from kannwas.config import LMS_CONFIG, load_config
+from kannwas.trace import Tracer
+from kannwas.util import generate_schedule, merge_csv
 
 
 # Commands that don't require Canvas API access
 OFFLINE_COMMANDS = {"build", "clean", "start", "preprocess", "schedule"}
 
+# Commands that can run for several courses with --courses
+MULTI_COURSE_COMMANDS = {"publish", "roster", "discussions", "due"}
+
+
+class CLI(click.Group):
+    def resolve_command(self, ctx, args):
+        name, command, args = super().resolve_command(ctx, args)
+        # Showing a command's help needs neither Canvas nor lms.yml
+        ctx.meta["help"] = any(arg in ctx.help_option_names for arg in args)
+        return name, command, args
+
 
 class Configuration(object):
-    def __init__(self, canvas=None, course=None):
+    def __init__(
+        self,
+        canvas=None,
+        course=None,
+        config=None,
+        tracer=None,
+        courses=None,
+        course_jobs=1,
+    ):
         self.canvas = canvas
         self.course = course
+        self.config = config
+        self.tracer = tracer
+        self.courses = courses or ([course] if course else [])
+        self.course_jobs = course_jobs
+
+    def pool_size(self, jobs) -> int:
+        """The connections needed to run jobs requests for each concurrent course."""
+        return max(jobs * min(self.course_jobs, len(self.courses)), 10)
+
+
+def parse_courses(ctx, param, value):
+    """Read --courses: comma-separated course ids or a file with one per line."""
+    if value is None:
+        return None
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            ids = [line.split("#")[0] for line in f]
+    else:
+        ids = value.split(",")
+    ids = [course_id.strip() for course_id in ids if course_id.strip()]
+    if not ids or not all(course_id.isdigit() for course_id in ids):
+        raise click.BadParameter(
+            "expected comma-separated course ids or a file with one id per line"
+        )
+    return list(dict.fromkeys(int(course_id) for course_id in ids))
+
+
+def course_output(path, course, courses) -> str:
+    """Name a course's output file after the course when running for several."""
+    if len(courses) == 1:
+        return path
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}-{course.id}{path.suffix}"))
+
+
+def for_each_course(ctx, run):
+    """Call run(course) for every course, course_jobs of them at a time.
+
+    Exits with 1 after all courses ran if any of them failed.
+    """
+    courses = ctx.obj.courses
+    if len(courses) == 1:
+        run(courses[0])
+        return
+    failed = []
+    with ThreadPoolExecutor(max_workers=ctx.obj.course_jobs) as pool:
+        futures = {course.id: pool.submit(run, course) for course in courses}
+        for course_id, future in futures.items():
+            try:
+                future.result()
+                click.echo(f"Course {course_id}: done")
+            except Exception as e:
+                failed.append(str(course_id))
+                click.echo(f"Course {course_id}: failed ({e})")
+    if failed:
+        click.echo(f"{len(failed)} course(s) failed: {', '.join(failed)}")
+        exit(1)
+
+
+def export_for_each_course(ctx, output, merge, export):
+    """Call export(course, path) for every course.
+
+    With several courses each one is written to its own output-<course id>
+    file, which merge combines into output with a course_id column.
+    """
+    courses = ctx.obj.courses
+    for_each_course(
+        ctx, lambda course: export(course, course_output(output, course, courses))
+    )
+    if merge and len(courses) > 1:
+        parts = [
+            (course.id, course_output(output, course, courses)) for course in courses
+        ]
+        rows = merge_csv(output, parts)
+        for _, part in parts:
+            os.remove(part)
+        click.echo(f"Merged {rows} rows of {len(parts)} courses into {output}")
+
+
+def merge_option(command):
+    return click.option(
+        "--merge/--no-merge",
+        default=False,
+        help="With --courses, write one file with a course_id column "
+        "instead of one file per course",
+    )(command)
+
+
+def get_config():
+    """Load lms.yml, exiting with its schema errors if it is invalid."""
+    from pydantic import ValidationError
+
+    try:
+        return load_config()
+    except ValidationError as e:
+        click.echo(f"Invalid {LMS_CONFIG.as_posix()}:\n{e}")
+        exit(1)
+
+
+def http_cache_options(command):
+    """Add the opt-in HTTP cache options of the read-only commands."""
+    command = click.option(
+        "--max-age",
+        default=0,
+        type=click.IntRange(min=0),
+        help="Reuse cached responses up to this many seconds old without revalidating",
+    )(command)
+    return click.option(
+        "--cache/--no-cache",
+        default=False,
+        help="Cache downloads in .kannwas and revalidate them with ETags",
+    )(command)
+
+
+def use_http_cache(ctx, max_age):
+    from kannwas.requester import HTTPCache, add_middleware
+
+    cache = HTTPCache(Path("."), max_age)
+    add_middleware(ctx.obj.canvas, cache)
+
+    def close():
+        click.echo(cache.summary())
+        cache.close()
 
+    ctx.call_on_close(close)
 
-@click.group()
+
+def report_trace(tracer, path):
+    tracer.save(path)
+    click.echo(tracer.format_summary())
+    click.echo(f"Trace written to {path}")
+
+
+@click.group(cls=CLI)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False),
+    help="Record every HTTP request and write the trace as JSON to this file",
+)
+@click.option(
+    "--courses",
+    callback=parse_courses,
+    help="Run for these courses instead of lms.yml's: comma-separated course "
+    "ids or a file with one id per line (publish, roster, discussions and due)",
+)
+@click.option(
+    "--course-jobs",
+    default=4,
+    type=click.IntRange(min=1),
+    help="Number of courses to run concurrently with --courses",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, trace, courses, course_jobs):
     """
     A CLI to interact with a Canvas course
     """
+    tracer = None
+    if trace:
+        tracer = Tracer()
+        ctx.call_on_close(lambda: report_trace(tracer, trace))
+
+    if courses and ctx.invoked_subcommand not in MULTI_COURSE_COMMANDS:
+        click.echo(f"{ctx.invoked_subcommand} does not support --courses")
+        exit(1)
+
     # Skip Canvas initialization for offline commands
-    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
-        ctx.obj = Configuration()
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS or ctx.meta.get("help"):
+        ctx.obj = Configuration(tracer=tracer)
         return
 
     if "CANVAS_API_KEY" not in os.environ:
         click.echo("CANVAS_API_KEY environment variable not set")
         exit(1)
-    if not Path("./lms/lms.yml").exists():
+    if not LMS_CONFIG.exists():
         click.echo("Does not appear to be a course template (lms.yml missing)")
         exit(1)
-    yml = Template(filename=Path("./lms/lms.yml").as_posix()).render()
-    global_metadata = yaml.safe_load(yml)
-    canvas = Canvas(global_metadata["canvas_url"], os.getenv("CANVAS_API_KEY"))
-    course = canvas.get_course(global_metadata["canvas_page_id"])
-    ctx.obj = Configuration(canvas, course)
+    from canvasapi import Canvas
+    from kannwas.requester import Throttle, add_middleware, set_pool_size
+
+    config = get_config()
+    canvas = Canvas(config.canvas_url, os.getenv("CANVAS_API_KEY"))
+    # The tracer goes innermost so every throttled retry is recorded
+    if tracer:
+        add_middleware(canvas, tracer)
+    add_middleware(canvas, Throttle())
+    if courses:
+        # All courses share the requester and so its connection pool
+        set_pool_size(canvas, max(course_jobs, 10))
+        with ThreadPoolExecutor(max_workers=course_jobs) as pool:
+            courses = list(pool.map(canvas.get_course, courses))
+        ctx.obj = Configuration(
+            canvas, courses[0], config, tracer, courses, course_jobs
+        )
+        return
+    course = canvas.get_course(config.canvas_page_id)
+    ctx.obj = Configuration(canvas, course, config, tracer)
 
 
 @cli.command()
@@ -87,6 +269,13 @@ def start(port):
     help="Specify the extra files input directory",
 )
 @click.option("--output", default="build", help="Specify the build directory")
+@click.option(
+    "--jobs",
+    "-j",
+    default=4,
+    type=click.IntRange(min=1),
+    help="Number of files to build concurrently",
+)
 def build(
     lecture,
     lecture_dir,
@@ -97,15 +286,24 @@ def build(
     extras,
     extras_dir,
     output,
+    jobs,
 ):
     """Build the materials"""
+    from kannwas.build import build_assessments, build_lectures, copy_extras
+
+    if LMS_CONFIG.exists():
+        get_config()
     click.echo("Building the learning materials")
+    failed = []
     if assessments:
-        build_assessments(Path(assessments_dir), Path(output))
+        failed.extend(build_assessments(Path(assessments_dir), Path(output), jobs))
     if lecture:
-        build_lectures(Path(lecture_dir), html, pdf, Path(output))
+        failed.extend(build_lectures(Path(lecture_dir), html, pdf, Path(output), jobs))
     if extras:
         copy_extras(Path(extras_dir), Path(output))
+    if failed:
+        click.echo(f"{len(failed)} file(s) failed to build: {', '.join(failed)}")
+        exit(1)
 
 
 @cli.command()
@@ -137,6 +335,8 @@ def preprocess(input_dir, output_dir):
     making week_1 and timedelta available for date calculations.
     Useful for CI/CD pipelines where Docker-in-Docker isn't available.
     """
+    from kannwas.build import load_week_1, render_assessment_file
+
     input_path = Path(input_dir)
     output_path = Path(output_dir)
 
@@ -144,6 +344,8 @@ def preprocess(input_dir, output_dir):
         click.echo(f"Error: Input directory '{input_path}' does not exist")
         exit(1)
 
+    if LMS_CONFIG.exists():
+        get_config()
     week_1 = load_week_1()
     if not week_1:
         click.echo(
@@ -178,48 +380,116 @@ def preprocess(input_dir, output_dir):
 
 @cli.command()
 @click.option("--lms", default="./lms", help="Specify the lms input directory")
+@click.option(
+    "--force/--no-force",
+    default=False,
+    help="Send every edit, even if it matches the last published content",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of pages, discussions and assignments to publish concurrently",
+)
 @click.pass_context
-def publish(ctx, lms):
+def publish(ctx, lms, force, jobs):
     """Publish the application."""
+    from kannwas.publish import publish as _publish
+    from kannwas.requester import set_pool_size
+
     click.echo("Publishing to Canvas")
-    _publish(ctx.obj.canvas, ctx.obj.course, Path(lms))
+    set_pool_size(ctx.obj.canvas, ctx.obj.pool_size(jobs))
+    for_each_course(
+        ctx, lambda course: _publish(ctx.obj.canvas, course, Path(lms), force, jobs)
+    )
 
 
 @cli.command()
 @click.option("--output", default="roster.csv", help="Specify the output file")
+@merge_option
+@http_cache_options
 @click.pass_context
-def roster(ctx, output):
+def roster(ctx, output, merge, cache, max_age):
     """
     Download the student roster of the course in csv format
     """
-    downloadRoster(ctx.obj.course, output)
+    from kannwas.requester import set_pool_size
+    from kannwas.roster import downloadRoster
+
+    if cache:
+        use_http_cache(ctx, max_age)
+    set_pool_size(ctx.obj.canvas, ctx.obj.pool_size(4))
+    export_for_each_course(ctx, output, merge, downloadRoster)
 
 
 @cli.command()
 @click.option("--output", default="discussions.csv", help="Specify the output file")
 @click.option("--topic", default=0, help="Specify the discussion topic id")
+@click.option(
+    "--jobs",
+    "-j",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of topics to download concurrently",
+)
+@merge_option
+@http_cache_options
 @click.pass_context
-def discussions(ctx, output, topic):
+def discussions(ctx, output, topic, jobs, merge, cache, max_age):
     """
     Download the discussions of the course in csv format
     """
-    downloadDiscussions(ctx.obj.course, topic, output)
+    from kannwas.discussions import downloadDiscussions
+    from kannwas.requester import set_pool_size
+
+    if cache:
+        use_http_cache(ctx, max_age)
+    set_pool_size(ctx.obj.canvas, ctx.obj.pool_size(jobs))
+    export_for_each_course(
+        ctx,
+        output,
+        merge,
+        lambda course, path: downloadDiscussions(course, topic, path, jobs),
+    )
 
 
 @cli.command()
-@click.option("-a", "--assignment", help="Specify the assignment")
+@click.option(
+    "-a", "--assignment", help="Specify the assignment by id or, across courses, name"
+)
 @click.option(
     "_input",
     "-i",
     "--input",
     help="Specify the extensions input file",
 )
+@click.option(
+    "--output", default="extensions.csv", help="Specify the export output file"
+)
+@merge_option
+@http_cache_options
 @click.pass_context
-def due(ctx, assignment, _input):
+def due(ctx, assignment, _input, output, merge, cache, max_age):
     """
     Update the due dates for an assignment
     """
-    updateDueDates(ctx.obj.course, assignment, _input)
+    from kannwas.assignment import updateDueDates
+    from kannwas.requester import set_pool_size
+
+    # Only exports are cached, imports need to see their own changes
+    if cache and not _input:
+        use_http_cache(ctx, max_age)
+    set_pool_size(ctx.obj.canvas, ctx.obj.pool_size(4))
+    if _input:
+        for_each_course(ctx, lambda course: updateDueDates(course, assignment, _input))
+    else:
+        export_for_each_course(
+            ctx,
+            output,
+            merge,
+            lambda course, path: updateDueDates(course, assignment, None, path),
+        )
 
 
 @cli.command()
@@ -230,11 +500,16 @@ def due(ctx, assignment, _input):
     "--input",
     help="Specify the moderation input file",
 )
+@http_cache_options
 @click.pass_context
-def moderate(ctx, assignment, _input):
+def moderate(ctx, assignment, _input, cache, max_age):
     """
     Moderate the marks of a section, group, or student
     """
+    from kannwas.assignment import adjustMarks
+
+    if cache and not _input:
+        use_http_cache(ctx, max_age)
     adjustMarks(ctx.obj.course, assignment, _input)
 
 
@@ -261,13 +536,24 @@ def schedule(weeks, questions, groups):
     default="padlet.csv",
     help="Specify the output file",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Number of boards to download concurrently",
+)
+@click.option("--http2/--no-http2", default=False, help="Use HTTP/2 if available")
 @click.pass_context
-def padlet(ctx, color, output):
+def padlet(ctx, color, output, jobs, http2):
     """Download the Padlet posts"""
+    from kannwas.padlet import export_padlet
+
     if "PADLET_API_KEY" not in os.environ:
         click.echo("PADLET_API_KEY environment variable not set")
         exit(1)
-    export_padlet(color, output)
+    hooks = ctx.obj.tracer.httpx_hooks() if ctx.obj.tracer else None
+    export_padlet(color, output, jobs, http2, hooks)
 
 
 @cli.command()
@@ -283,8 +569,17 @@ def padlet(ctx, color, output):
     default="./images",
     help="Specify the output directory",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of QR codes to render in parallel (default: one per CPU)",
+)
 @click.pass_context
-def qr(ctx, input, output):
+def qr(ctx, input, output, jobs):
     """Generate QR codes from a CSV file"""
-    create_qr_codes(Path(input), Path(output))
+    from kannwas.padlet import create_html_qr_sections, create_qr_codes
+
+    create_qr_codes(Path(input), Path(output), jobs)
     create_html_qr_sections(Path(input), Path(output))
@@ -0,0 +1,33 @@
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kannwas.models import LMSConfig
+
+
+LMS_CONFIG = Path("./lms/lms.yml")
+
+# Parsed configurations by resolved path, with the mtime they were read at
+_configs = {}
+
+
+def load_config(path: Path = LMS_CONFIG) -> "LMSConfig":
+    """Render and parse lms.yml, once per process unless the file changes.
+
+    Raises FileNotFoundError if the file is missing and pydantic's
+    ValidationError if it does not match the LMSConfig schema.
+    """
+    # Imported here so importing LMS_CONFIG stays cheap for the CLI
+    import yaml
+
+    from kannwas.models import LMSConfig
+    from kannwas.templates import render_file
+
+    path = Path(path).resolve()
+    mtime = path.stat().st_mtime_ns
+    cached = _configs.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    config = LMSConfig.model_validate(yaml.safe_load(render_file(path)))
+    _configs[path] = (mtime, config)
+    return config
@@ -1,41 +1,108 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 from markdownify import markdownify as md
-import pandas as pd
 
+from kannwas.cache import ContentCache
 from kannwas.models import DiscussionEntry
+from kannwas.requester import get_requester, paginate
+from kannwas.util import write_csv
 
-def getDiscussions(course, topic) -> list[DiscussionEntry]:
-    contributions =[]
-    discussion_topic = course.get_discussion_topic(topic)
-    posts = discussion_topic.get_topic_entries()
-
-    for post in posts:
-        contributions.append(DiscussionEntry(
-            id=post.id,
-            user_id=post.user_id,
-            type="post",
-            message=md(post.message),
-            created_at=post.created_at,
-            updated_at=post.updated_at,
-        ))
-        for reply in post.get_replies():
-            contributions.append(DiscussionEntry(
-                id=reply.id,
-                user_id=reply.user_id,
-                type="reply",
-                message=md(reply.message),
-                created_at=reply.created_at,
-                updated_at=reply.updated_at,
-            ))
+def getTopicView(course, topic_id) -> dict:
+    """Fetch the whole thread tree of a topic in a single request.
+
+    Canvas builds the view in the background and answers 503 until it is
+    ready, which the Throttle middleware retries. Entries posted since it was
+    last built come back in new_entries.
+    """
+    response = get_requester(course).request(
+        "GET",
+        f"courses/{course.id}/discussion_topics/{topic_id}/view",
+        include_new_entries=1,
+    )
+    return response.json()
+
+def walkEntries(entries, depth=0):
+    for entry in entries:
+        yield entry, depth
+        yield from walkEntries(entry.get("replies", []), depth + 1)
+
+def getDiscussions(course, topic) -> list[dict]:
+    """Return a topic's entries as DiscussionEntry rows, messages still in HTML."""
+    contributions = []
+    view = getTopicView(course, getattr(topic, "id", topic))
+    seen = set()
+    entries = list(walkEntries(view.get("view", [])))
+    # New entries come flat, so anything with a parent counts as a reply
+    entries.extend(
+        (entry, 0 if entry.get("parent_id") is None else 1)
+        for entry in view.get("new_entries", [])
+    )
+
+    for entry, depth in entries:
+        if entry["id"] in seen or entry.get("deleted"):
+            continue
+        seen.add(entry["id"])
+        contributions.append({
+            "id": entry["id"],
+            "user_id": entry["user_id"],
+            "parent_id": entry.get("parent_id"),
+            "type": "post" if depth == 0 else "reply",
+            "message": entry.get("message") or "",
+            "created_at": entry["created_at"],
+            "updated_at": entry["updated_at"],
+        })
     return contributions
 
-def downloadDiscussions(course, topic, path):
-    if topic == 0:
-        topics = course.get_discussion_topics()
-        all_contributions = []
-        for topic in topics:
-            all_contributions.extend(getDiscussions(course, topic))
-    else:
-        all_contributions = getDiscussions(course, topic)
-    all_contributions = [contribution.model_dump() for contribution in all_contributions]
-    contribution_sheet = pd.DataFrame(all_contributions)
-    contribution_sheet.to_csv(path, index=False)
+def convertMessages(messages: list[str]) -> list[str]:
+    return [md(message) for message in messages]
+
+def finishTopic(converted, contributions, missing, future):
+    """Fill in a topic's converted messages once its conversion is done."""
+    if future is not None:
+        for message, markdown in zip(missing, future.result()):
+            converted.set(message, markdown)
+        converted.save()
+    for contribution in contributions:
+        contribution["message"] = converted.get(contribution["message"])
+    return contributions
+
+def downloadDiscussions(course, topic, path, jobs=8):
+    topics = paginate(course.get_discussion_topics()) if topic == 0 else [topic]
+    converted = ContentCache(Path("."), "markdown")
+
+    def rows():
+        scheduled = set()
+        pending = deque()
+        # Topics are fetched on threads and their messages converted in worker
+        # processes as soon as they arrive, overlapping with the other downloads.
+        # Rows are written in topic order as soon as their topic is converted
+        with (
+            ThreadPoolExecutor(max_workers=jobs) as fetchers,
+            ProcessPoolExecutor() as converters,
+        ):
+            topic_contributions = fetchers.map(
+                lambda topic: getDiscussions(course, topic), topics
+            )
+            for contributions in topic_contributions:
+                missing = list({
+                    contribution["message"]
+                    for contribution in contributions
+                    if contribution["message"] not in scheduled
+                    and converted.get(contribution["message"]) is None
+                })
+                scheduled.update(missing)
+                future = converters.submit(convertMessages, missing) if missing else None
+                pending.append((contributions, missing, future))
+                while pending and (pending[0][2] is None or pending[0][2].done()):
+                    yield from finishTopic(converted, *pending[0])
+                    # Finished messages are found in the cache from now on
+                    scheduled.difference_update(pending.popleft()[1])
+            while pending:
+                yield from finishTopic(converted, *pending[0])
+                scheduled.difference_update(pending.popleft()[1])
+
+    try:
+        write_csv(path, list(DiscussionEntry.model_fields), rows())
+    finally:
+        converted.close()
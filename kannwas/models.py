@@ -1,5 +1,7 @@
+from copy import deepcopy
+from datetime import date, datetime
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, PrivateAttr, model_validator
 
 class Student(BaseModel):
     id: int
@@ -9,21 +11,61 @@ class Student(BaseModel):
     email: str
     section: Optional[str]
     group: Optional[str]
+    groups: dict[str, str] = {}
 
 class DiscussionEntry(BaseModel):
     id: int
     user_id: int
+    parent_id: Optional[int] = None
     type: str
     message: str
     created_at: str
     updated_at: str
 
-class PadletPost(BaseModel):
-    id: str
-    section_id: str
-    section_title: str
-    board_id: str
-    board_title: str
-    username: str
-    content: str
-    color: Optional[str]
\ No newline at end of file
+class Module(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    title: str
+    published: bool
+    unlock_at: Optional[datetime | date] = None
+    pages: list[str] = []
+
+class AssignmentGroup(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    title: str
+    assignments: list[str] = []
+
+class LMSConfig(BaseModel):
+    """The course configuration in lms/lms.yml.
+
+    Unknown keys are kept, as every key is also available to the page templates.
+    The templates get the values as YAML parsed them, see metadata.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    _raw: dict = PrivateAttr(default_factory=dict)
+
+    canvas_url: str
+    canvas_page_id: int
+    week_1: Optional[date | datetime] = None
+    frontpage: Optional[str] = None
+    modules: dict[str, Module] = {}
+    discussions: list[str] = []
+    assignments: dict[str, AssignmentGroup] = {}
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def keep_raw(cls, data, handler):
+        config = handler(data)
+        if isinstance(data, dict):
+            config._raw = deepcopy(data)
+        return config
+
+    def metadata(self) -> dict:
+        """Return the configuration as the plain dict the templates render with.
+
+        Values keep the types YAML gave them, e.g. a quoted week_1 stays a
+        string, so templates render as they did before validation.
+        """
+        return deepcopy(self._raw)
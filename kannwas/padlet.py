@@ -1,10 +1,12 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import importlib.metadata
+import importlib.util
 import os
 from pathlib import Path
-import httpx
 import pandas as pd
-import qrcode
 
-from kannwas.models import PadletPost
+from kannwas.cache import load_json, payload_hash, save_json, state_path
 
 USER_ENDPOINT = "https://api.padlet.dev/v1/me?include=boards"
 BOARD_ENDPOINT = "https://api.padlet.dev/v1/boards/{board_id}?include=posts%2Csections"
@@ -14,17 +16,42 @@ headers = {
     "x-api-key": os.getenv("PADLET_API_KEY")
 }
 
-def create_qr_codes(input_file: Path, output_dir: Path):
+QR_RENDER_PARAMS = {"box_size": 10, "border": 4}
+
+def render_qr_code(link: str, path: Path):
+    # Imported here, like httpx below, as the qr and padlet commands each need
+    # only one of them
+    import qrcode
+
+    qrcode.make(link, **QR_RENDER_PARAMS).save(path)
+
+def create_qr_codes(input_file: Path, output_dir: Path, jobs=None):
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
 
+    # Hash of everything that went into each image, to skip unchanged ones
+    hashes_path = state_path(Path("."), "qr.json")
+    hashes = load_json(hashes_path)
+    params = {**QR_RENDER_PARAMS, "qrcode": importlib.metadata.version("qrcode")}
     df = pd.read_csv(input_file)
+    todo = []
     for index, row in df.iterrows():
         qr_code = f"{row['workshop']}-{row['week']:02}.png"
         qr_code_path = output_dir / qr_code
 
-        img = qrcode.make(row['breakout_room_link'])
-        img.save(qr_code_path)
+        key = payload_hash({"link": row['breakout_room_link'], **params})
+        if qr_code_path.exists() and hashes.get(qr_code_path.as_posix()) == key:
+            continue
+        todo.append((row['breakout_room_link'], qr_code_path, key))
+
+    print(f"Generating {len(todo)} QR codes, {len(df) - len(todo)} unchanged")
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(render_qr_code, link, path) for link, path, _ in todo]
+            for future, (_, path, key) in zip(futures, todo):
+                future.result()
+                hashes[path.as_posix()] = key
+        save_json(hashes_path, hashes)
 
 def create_html_qr_sections(input_file: Path, output_dir: Path):
     if not output_dir.exists():
@@ -41,52 +68,95 @@ def create_html_qr_sections(input_file: Path, output_dir: Path):
   </div>
 </details>"""
 
+    sections = ["# Padlet QR Code Sections for each Week"]
+    df['week'] = df['week'].astype(int)
+    for week_nr, week_df in df.groupby('week', sort=False):
+        sections.append(f"\n\n## Week {week_nr}\n")
+        for workshop, link in zip(week_df['workshop'], week_df['breakout_room_link']):
+            sections.append(template.format(
+                section=workshop.upper(),
+                section_lower=workshop.lower(),
+                link=link
+            ))
+
     with open(output_dir / "qr-sections.md", "w") as f:
-        f.write("# Padlet QR Code Sections for each Week")
-
-        df['week'] = df['week'].astype(int)
-        weeks = df['week'].unique()
-        for week_nr in weeks:
-            f.write(f"\n\n## Week {week_nr}\n")
-            week_df = df[df['week'] == week_nr]
-
-            for index, row in week_df.iterrows():
-                output = template.format(
-                    section=row['workshop'].upper(),
-                    section_lower=row['workshop'].lower(),
-                    link=row['breakout_room_link']
-                )
-                f.write(output)
-
-def export_padlet(color, output: Path):
-    user_response = httpx.get(USER_ENDPOINT, headers=headers)
-
-    user_data = user_response.json()
-    board_mapping = {
-        board["id"]: board["attributes"]["title"]
-        for board in user_data["included"] if board["type"] == "board"
-    }
-
-    posts = []
-    for id, title in board_mapping.items():
-        print(f"Board ID: {id}, Title: {title}")
-        board_response = httpx.get(BOARD_ENDPOINT.format(board_id=id), headers=headers)
-        board_data = board_response.json()
-
-        section_mapping = {
-            section["id"]: section["attributes"]["title"]
-            for section in board_data["included"] if section["type"] == "section"
+        f.write("".join(sections))
+
+async def fetch_json(client, url, semaphore, retries=5):
+    """GET a Padlet endpoint, retrying with backoff on 429, 5xx and network errors."""
+    import httpx
+
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                response = await client.get(url)
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(2**attempt)
+                continue
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if retryable and attempt < retries:
+                retry_after = response.headers.get("retry-after", "")
+                delay = float(retry_after) if retry_after.isdigit() else 2**attempt
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+async def fetch_boards(jobs, http2, event_hooks=None):
+    import httpx
+
+    limits = httpx.Limits(max_connections=jobs, max_keepalive_connections=jobs)
+    semaphore = asyncio.Semaphore(jobs)
+    async with httpx.AsyncClient(
+        headers=headers, timeout=httpx.Timeout(30.0), limits=limits, http2=http2,
+        event_hooks=event_hooks
+    ) as client:
+        user_data = await fetch_json(client, USER_ENDPOINT, semaphore)
+        board_mapping = {
+            board["id"]: board["attributes"]["title"]
+            for board in user_data["included"] if board["type"] == "board"
         }
-
-        p = [PadletPost(id=post["id"], section_id=post["relationships"]["section"]["data"]["id"], section_title=section_mapping[post["relationships"]["section"]["data"]["id"]], board_id=post["relationships"]["board"]["data"]["id"], board_title=board_mapping[post["relationships"]["board"]["data"]["id"]], username=post["attributes"]["author"]["username"], content=post["attributes"]["content"]["bodyHtml"], color=post["attributes"]["color"]) for post in board_data["included"] if post["type"] == "post"]
-        posts.extend(p)
-
-    # save posts list to csv file using pandas
-    df = pd.DataFrame([post.__dict__ for post in posts])
+        for id, title in board_mapping.items():
+            print(f"Board ID: {id}, Title: {title}")
+        boards = await asyncio.gather(*(
+            fetch_json(client, BOARD_ENDPOINT.format(board_id=id), semaphore)
+            for id in board_mapping
+        ))
+    return board_mapping, boards
+
+def flatten_boards(board_mapping, boards):
+    """Flatten the board payloads straight into a posts and a sections DataFrame."""
+    posts = {"board_id": [], "section_id": [], "username": [], "color": []}
+    sections = {"board_id": [], "section_id": [], "section_title": []}
+    for board_id, board_data in zip(board_mapping, boards):
+        for item in board_data["included"]:
+            if item["type"] == "post":
+                posts["board_id"].append(item["relationships"]["board"]["data"]["id"])
+                posts["section_id"].append(item["relationships"]["section"]["data"]["id"])
+                posts["username"].append(item["attributes"]["author"]["username"])
+                posts["color"].append(item["attributes"]["color"])
+            elif item["type"] == "section":
+                sections["board_id"].append(board_id)
+                sections["section_id"].append(item["id"])
+                sections["section_title"].append(item["attributes"]["title"])
+    return pd.DataFrame(posts), pd.DataFrame(sections)
+
+def export_padlet(color, output: Path, jobs=8, http2=False, event_hooks=None):
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("HTTP/2 needs the h2 package (pip install httpx[http2]), using HTTP/1.1")
+        http2 = False
+    board_mapping, boards = asyncio.run(fetch_boards(jobs, http2, event_hooks))
+
+    posts, sections = flatten_boards(board_mapping, boards)
+
+    # Resolve section titles per board with a join instead of per-post lookups
+    df = posts.merge(sections, on=["board_id", "section_id"], how="left")
 
     # Create pinned and post count columns
-    df["pinned_count"] = df["color"].apply(lambda x: 1 if x == color else 0)
-    df["post_count"] = df["color"].apply(lambda x: 1 if x is None else 0)
+    df["pinned_count"] = (df["color"] == color).astype(int)
+    df["post_count"] = df["color"].isna().astype(int)
 
     # Group by username and section_title, then sum counts
     grouped = df.groupby(["username", "section_title"]).agg({
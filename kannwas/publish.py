@@ -1,28 +1,122 @@
-from mako.template import Template
-from mako.lookup import TemplateLookup
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import re
-import yaml
+import threading
 import frontmatter
 from datetime import datetime
 import markdown
 
+from kannwas.cache import Manifest, UploadCache
+from kannwas.config import load_config
+from kannwas.requester import paginate
+from kannwas.templates import get_template, prune_templates
+
+
+class CourseState(object):
+    """Title-keyed indexes of the course's Canvas objects for a single publish.
+
+    Each collection is listed once, on first use, and kept up to date as
+    objects are created so lookups never go back to the API. Safe to share
+    between the publish worker threads.
+    """
+
+    def __init__(self, canvas, course, uploads, manifest):
+        self.canvas = canvas
+        self.course = course
+        self.uploads = uploads
+        self.manifest = manifest
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _index(self, name, fetch):
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = fetch()
+            return self._indexes[name]
+
+    @property
+    def pages(self):
+        return self._index(
+            "pages",
+            lambda: {page.title: page for page in paginate(self.course.get_pages())},
+        )
+
+    @property
+    def modules(self):
+        return self._index(
+            "modules",
+            lambda: {
+                module.name: module for module in paginate(self.course.get_modules())
+            },
+        )
+
+    @property
+    def assignment_groups(self):
+        return self._index(
+            "assignment_groups",
+            lambda: {
+                group.name: group
+                for group in paginate(self.course.get_assignment_groups())
+            },
+        )
+
+    @property
+    def assignments(self):
+        return self._index(
+            "assignments",
+            lambda: {
+                assignment.name: assignment
+                for assignment in paginate(self.course.get_assignments())
+            },
+        )
+
+    @property
+    def rubrics(self):
+        return self._index(
+            "rubrics",
+            lambda: {rubric.title for rubric in paginate(self.course.get_rubrics())},
+        )
 
-def load_markdown(course, path: Path, lms_path: Path, global_metadata: dict):
-    lookup = TemplateLookup(directories=[(lms_path / "templates").as_posix()])
+    @property
+    def discussions(self):
+        def fetch():
+            announcements = paginate(
+                self.canvas.get_announcements(
+                    [self.course],
+                    start_date=datetime(2010, 1, 1, 0, 1),
+                    end_date=datetime(2999, 1, 1, 0, 1),
+                )
+            )
+            # Discussion topics take precedence over announcements with the same title
+            topics = {
+                announcement.title: announcement for announcement in announcements
+            }
+            topics.update(
+                {
+                    topic.title: topic
+                    for topic in paginate(self.course.get_discussion_topics())
+                }
+            )
+            return topics
+
+        return self._index("discussions", fetch)
+
+
+def load_markdown(path: Path, lms_path: Path, global_metadata: dict, uploads):
     with open(path, "r", encoding="utf-8") as f:
         md_text = f.read()
         escaped = re.sub(r"(?m)^(#{1,6})\s+", r'${"\1"} ', md_text)
     metadata = frontmatter.loads(escaped)
     merged = global_metadata | metadata.metadata
-    md = Template(escaped, lookup=lookup).render(**merged)
+    templates = (lms_path / "templates").as_posix()
+    md = get_template(escaped, templates).render(**merged)
     metadata = frontmatter.loads(md)
     page_content = markdown.markdown(metadata.content, extensions=["extra"])
-    page_content = replace_file_links(course, lms_path, page_content, global_metadata)
+    page_content = replace_file_links(lms_path, page_content, global_metadata, uploads)
     return metadata, page_content
 
 
-def replace_file_links(course, lms_path: Path, page_content, global_metadata):
+def replace_file_links(lms_path: Path, page_content, global_metadata, uploads):
     links = re.findall(r'href="(lecture\/.*|assessments\/.*|extra\/.*)"', page_content)
     images = re.findall(r'src="(images\/.*)"', page_content)
     for link in links:
@@ -33,11 +127,10 @@ def replace_file_links(course, lms_path: Path, page_content, global_metadata):
                 link, f"/courses/{global_metadata['canvas_page_id']}/"
             )
         else:
-            print(f"  Uploading: {path}")
-            file = course.upload(path)
+            file_id = uploads.upload(path)
             page_content = page_content.replace(
                 link,
-                f"/courses/{global_metadata['canvas_page_id']}/files/{file[1]['id']}",
+                f"/courses/{global_metadata['canvas_page_id']}/files/{file_id}",
             )
     for image in images:
         path = lms_path / image
@@ -47,41 +140,50 @@ def replace_file_links(course, lms_path: Path, page_content, global_metadata):
                 image, f"/courses/{global_metadata['canvas_page_id']}/"
             )
         else:
-            print(f"  Uploading: {path}")
-            file = course.upload(path)
+            file_id = uploads.upload(path)
             page_content = page_content.replace(
                 image,
-                f"/courses/{global_metadata['canvas_page_id']}/files/{file[1]['id']}/preview",
+                f"/courses/{global_metadata['canvas_page_id']}/files/{file_id}/preview",
             )
     return page_content
 
 
-def create_frontpage(course, lms_path: Path, page_path: Path, global_metadata):
-    metadata, page_content = load_markdown(course, page_path, lms_path, global_metadata)
+def create_frontpage(state, lms_path: Path, page_path: Path, global_metadata):
+    metadata, page_content = load_markdown(
+        page_path, lms_path, global_metadata, state.uploads
+    )
 
     frontpage = {
         "title": metadata["title"],
         "published": metadata["published"],
         "body": page_content,
     }
-    course.edit_front_page(wiki_page=frontpage)
+    if not state.manifest.unchanged("frontpage", frontpage):
+        state.course.edit_front_page(wiki_page=frontpage)
+        state.manifest.record("frontpage", frontpage)
 
 
-def create_module(course, lms_path: Path, module_dict, global_metadata):
-    pages = [
-        create_page(course, lms_path, lms_path / Path(page), global_metadata)
-        for page in module_dict["pages"]
-    ]
-    modules_mapping = {module.name: module.id for module in course.get_modules()}
-
+def create_module(state, module_dict, pages):
     module_data = {"name": module_dict["title"], "published": module_dict["published"]}
     if "unlock_at" in module_dict.keys():
         module_data["unlock_at"] = module_dict["unlock_at"]
-    if module_dict["title"] in modules_mapping.keys():
-        module = course.get_module(modules_mapping[module_dict["title"]])
-        module.edit(module=module_data)
+    key = f"module:{module_dict['title']}"
+    existing = module_dict["title"] in state.modules.keys()
+    if existing:
+        module = state.modules[module_dict["title"]]
+        if not state.manifest.unchanged(key, module_data):
+            module.edit(module=module_data)
+            state.manifest.record(key, module_data)
     else:
-        module = course.create_module(module=module_data)
+        module = state.course.create_module(module=module_data)
+        state.modules[module.name] = module
+        state.manifest.record(key, module_data)
+
+    # Only list an existing module's items again if its set of pages changed
+    items_key = f"module-items:{module_dict['title']}"
+    page_urls = [page.url for page in pages]
+    if existing and state.manifest.unchanged(items_key, page_urls):
+        return
 
     module_items = [module_item.title for module_item in module.get_module_items()]
 
@@ -89,31 +191,37 @@ def create_module(course, lms_path: Path, module_dict, global_metadata):
         if page.title not in module_items:
             module_item_data = {"type": "Page", "page_url": page.url}
             module.create_module_item(module_item=module_item_data)
+    state.manifest.record(items_key, page_urls)
 
 
-def create_page(course, lms_path: Path, page_path: Path, global_metadata):
-    metadata, page_content = load_markdown(course, page_path, lms_path, global_metadata)
-
-    pages_mapping = {page.title: page.url for page in course.get_pages()}
+def create_page(state, lms_path: Path, page_path: Path, global_metadata):
+    metadata, page_content = load_markdown(
+        page_path, lms_path, global_metadata, state.uploads
+    )
 
     page_data = {
         "title": metadata["title"],
         "published": metadata["published"],
         "body": page_content,
     }
-    if metadata["title"] in pages_mapping.keys():
-        page = course.get_page(pages_mapping[metadata["title"]])
-        page.edit(wiki_page=page_data)
+    key = f"page:{metadata['title']}"
+    if metadata["title"] in state.pages.keys():
+        page = state.pages[metadata["title"]]
+        if not state.manifest.unchanged(key, page_data):
+            page.edit(wiki_page=page_data)
+            state.manifest.record(key, page_data)
     else:
-        page = course.create_page(wiki_page=page_data)
+        page = state.course.create_page(wiki_page=page_data)
+        state.pages[page.title] = page
+        state.manifest.record(key, page_data)
     return page
 
 
 def create_or_update_discussion(
-    canvas, lms_path: Path, course, discussion_path: Path, global_metadata
+    state, lms_path: Path, discussion_path: Path, global_metadata
 ):
     metadata, page_content = load_markdown(
-        course, discussion_path, lms_path, global_metadata
+        discussion_path, lms_path, global_metadata, state.uploads
     )
 
     discussion_data = {
@@ -125,45 +233,33 @@ def create_or_update_discussion(
         "is_announcement": metadata.get("is_announcement", False),
     }
 
-    for discussion in course.get_discussion_topics():
-        if discussion.title == metadata["title"]:
+    key = f"discussion:{metadata['title']}"
+    if metadata["title"] in state.discussions.keys():
+        discussion = state.discussions[metadata["title"]]
+        if not state.manifest.unchanged(key, discussion_data):
             discussion.update(**discussion_data)
-            return discussion
-
-    for announcement in canvas.get_announcements(
-        [course],
-        start_date=datetime(2010, 1, 1, 0, 1),
-        end_date=datetime(2999, 1, 1, 0, 1),
-    ):
-        if announcement.title == metadata["title"]:
-            announcement.update(**discussion_data)
-            return announcement
-
-    discussion = course.create_discussion_topic(**discussion_data)
+            state.manifest.record(key, discussion_data)
+        return discussion
+
+    discussion = state.course.create_discussion_topic(**discussion_data)
+    state.discussions[discussion.title] = discussion
+    state.manifest.record(key, discussion_data)
     return discussion
 
 
-def create_or_update_assignment_group(
-    course, lms_path, title, assignments, global_metadata
-):
-    group = None
-    for assignment_group in course.get_assignment_groups():
-        if assignment_group.name == title:
-            group = assignment_group
-            break
-    if not group:
-        group = course.create_assignment_group(name=title)
-    for assignment_path in assignments:
-        create_or_update_assignment(
-            course, lms_path, group, lms_path / Path(assignment_path), global_metadata
-        )
+def create_or_update_assignment_group(state, title):
+    if title in state.assignment_groups.keys():
+        return state.assignment_groups[title]
+    group = state.course.create_assignment_group(name=title)
+    state.assignment_groups[group.name] = group
+    return group
 
 
 def create_or_update_assignment(
-    course, lms_path: Path, group, assignment_path: Path, global_metadata
+    state, lms_path: Path, group, assignment_path: Path, global_metadata
 ):
     metadata, page_content = load_markdown(
-        course, assignment_path, lms_path, global_metadata
+        assignment_path, lms_path, global_metadata, state.uploads
     )
 
     assignment_data = {
@@ -180,29 +276,28 @@ def create_or_update_assignment(
         "assignment_group_id": group.id,
     }
 
-    assignment = None
-    for course_assignment in course.get_assignments():
-        if course_assignment.name == assignment_data["name"]:
-            assignment = course_assignment
-            break
-    if not assignment:
-        assignment = course.create_assignment(assignment=assignment_data)
+    key = f"assignment:{assignment_data['name']}"
+    if assignment_data["name"] in state.assignments.keys():
+        assignment = state.assignments[assignment_data["name"]]
+        if not state.manifest.unchanged(key, assignment_data):
+            assignment.edit(assignment=assignment_data)
+            state.manifest.record(key, assignment_data)
     else:
-        assignment.edit(assignment=assignment_data)
+        assignment = state.course.create_assignment(assignment=assignment_data)
+        state.assignments[assignment.name] = assignment
+        state.manifest.record(key, assignment_data)
 
     if "rubric" in metadata.keys():
         create_or_update_rubric(
-            course, metadata.get("rubric", []), assignment.name, assignment.id
+            state, metadata.get("rubric", []), assignment.name, assignment.id
         )
     return assignment
 
 
-def create_or_update_rubric(course, new_rubric, assignment_title, assignment_id):
-    rubrics = course.get_rubrics()
-    for rubric in rubrics:
-        if rubric.title == assignment_title:
-            print(f"{rubric.title} already exists, skipping...")
-            return
+def create_or_update_rubric(state, new_rubric, assignment_title, assignment_id):
+    if assignment_title in state.rubrics:
+        print(f"{assignment_title} already exists, skipping...")
+        return
 
     rubric = {
         "title": assignment_title,
@@ -221,7 +316,8 @@ def create_or_update_rubric(course, new_rubric, assignment_title, assignment_id)
         },
     }
 
-    rubric = course.create_rubric(rubric=rubric)
+    rubric = state.course.create_rubric(rubric=rubric)
+    state.rubrics.add(assignment_title)
 
     rubric_association = {
         "rubric_id": rubric["rubric"].id,
@@ -231,33 +327,81 @@ def create_or_update_rubric(course, new_rubric, assignment_title, assignment_id)
         "purpose": "grading",
     }
 
-    course.create_rubric_association(rubric_association=rubric_association)
-
-
-def publish(canvas, course, lms_path):
-    yml = Template(filename=Path(lms_path / "lms.yml").as_posix()).render()
-    global_metadata = yaml.safe_load(yml)
-
-    create_frontpage(
-        course,
-        lms_path,
-        lms_path / Path(global_metadata["frontpage"]),
-        global_metadata,
-    )
-
-    for _, module in global_metadata["modules"].items():
-        create_module(course, lms_path, module, global_metadata)
-
-    for discussion in global_metadata["discussions"]:
-        create_or_update_discussion(
-            canvas, lms_path, course, lms_path / Path(discussion), global_metadata
-        )
-
-    for _, assignment_group in global_metadata["assignments"].items():
-        create_or_update_assignment_group(
-            course,
-            lms_path,
-            assignment_group["title"],
-            assignment_group["assignments"],
-            global_metadata,
-        )
+    state.course.create_rubric_association(rubric_association=rubric_association)
+
+
+def publish(canvas, course, lms_path, force=False, jobs=1):
+    global_metadata = load_config(lms_path / "lms.yml").metadata()
+    # Links point at the course being published, which differs from lms.yml's
+    # when publishing to several courses
+    if str(global_metadata["canvas_page_id"]) != str(course.id):
+        global_metadata["canvas_page_id"] = course.id
+    uploads = UploadCache(course, lms_path.parent)
+    manifest = Manifest(course, lms_path.parent, force)
+    state = CourseState(canvas, course, uploads, manifest)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            # Independent upserts: the front page, every module page and every
+            # discussion
+            futures = [
+                pool.submit(
+                    create_frontpage,
+                    state,
+                    lms_path,
+                    lms_path / Path(global_metadata["frontpage"]),
+                    global_metadata,
+                )
+            ]
+            pages = {}
+            for _, module in global_metadata["modules"].items():
+                for page in module["pages"]:
+                    if page not in pages:
+                        pages[page] = pool.submit(
+                            create_page,
+                            state,
+                            lms_path,
+                            lms_path / Path(page),
+                            global_metadata,
+                        )
+            for discussion in global_metadata["discussions"]:
+                futures.append(
+                    pool.submit(
+                        create_or_update_discussion,
+                        state,
+                        lms_path,
+                        lms_path / Path(discussion),
+                        global_metadata,
+                    )
+                )
+
+            # Canvas orders assignment groups and modules by when they were
+            # created, so they are created one at a time in lms.yml order.
+            # Assignments send their position and can be created concurrently
+            for assignment_group in global_metadata["assignments"].values():
+                group = create_or_update_assignment_group(
+                    state, assignment_group["title"]
+                )
+                for assignment_path in assignment_group["assignments"]:
+                    futures.append(
+                        pool.submit(
+                            create_or_update_assignment,
+                            state,
+                            lms_path,
+                            group,
+                            lms_path / Path(assignment_path),
+                            global_metadata,
+                        )
+                    )
+            for _, module in global_metadata["modules"].items():
+                module_pages = [pages[page].result() for page in module["pages"]]
+                create_module(state, module, module_pages)
+
+            for future in futures:
+                future.result()
+    finally:
+        uploads.save()
+        manifest.save()
+        prune_templates()
+        print(uploads.summary())
+        print(manifest.summary())
@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import json
+import re
+import sqlite3
+import threading
+import time
+import requests
+from canvasapi.paginated_list import PaginatedList
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from kannwas.cache import state_path, text_hash
+from kannwas.trace import page_number
+
+
+def get_requester(canvas):
+    """Return the canvasapi Requester shared by a Canvas instance and its objects.
+
+    canvas may also be one of those objects, e.g. a Course.
+    """
+    requester = getattr(canvas, "_requester", None)
+    return requester if requester is not None else canvas._Canvas__requester
+
+
+def add_middleware(canvas, middleware):
+    """Wrap every HTTP request canvasapi makes through canvas.
+
+    A middleware is called as middleware(send, method, url, **kwargs) and must
+    return a requests.Response, usually by calling send(method, url, **kwargs).
+    Middlewares added later wrap the ones added before them.
+    """
+    session = get_requester(canvas)._session
+    send = session.request
+
+    def request(method, url, **kwargs):
+        return middleware(send, method, url, **kwargs)
+
+    session.request = request
+
+
+def set_pool_size(canvas, size: int):
+    """Allow up to size concurrent connections to the Canvas host."""
+    session = get_requester(canvas)._session
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+# Pages of a list fetched at once once its last page is known
+PAGE_JOBS = 4
+
+
+def page_elements(items, response) -> list:
+    """Build the objects of one page of a PaginatedList, as canvasapi does."""
+    data = response.json()
+    if items._root:
+        data = data[items._root]
+    return [
+        items._content_class(items._requester, {**element, **items._extra_attribs})
+        for element in data
+        if element is not None
+    ]
+
+
+def link_endpoint(requester, url: str) -> str:
+    """Strip the API base URL from a Link header URL."""
+    return re.sub(rf"^{re.escape(requester.base_url)}", "", url)
+
+
+def with_page(url: str, page: int) -> str:
+    parts = urlsplit(url)
+    query = [
+        (key, str(page) if key == "page" else value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def paginate(items, jobs=PAGE_JOBS):
+    """Yield the elements of a canvasapi PaginatedList in order.
+
+    canvasapi follows next links one page (of per_page=100) at a time. When the
+    first page's Link header names a numbered last page, the remaining pages
+    are fetched on jobs threads instead. Lists paginated with bookmarks are
+    followed page by page as usual.
+    """
+    if not isinstance(items, PaginatedList) or items._elements:
+        yield from items
+        return
+    requester = items._requester
+
+    def fetch(endpoint, params=None):
+        return requester.request(
+            items._request_method, endpoint, _url=items._url_override, **(params or {})
+        )
+
+    response = fetch(items._first_url, dict(items._first_params))
+    yield from page_elements(items, response)
+    next_link = response.links.get("next")
+    if next_link is None:
+        return
+
+    last = response.links.get("last")
+    last_page = page_number(last["url"]) if last else None
+    next_page = page_number(next_link["url"])
+    numbered = isinstance(last_page, int) and isinstance(next_page, int)
+    if not numbered or last_page < next_page:
+        while next_link is not None:
+            response = fetch(link_endpoint(requester, next_link["url"]))
+            yield from page_elements(items, response)
+            next_link = response.links.get("next")
+        return
+
+    endpoints = [
+        link_endpoint(requester, with_page(next_link["url"], page))
+        for page in range(next_page, last_page + 1)
+    ]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for response in pool.map(fetch, endpoints):
+            yield from page_elements(items, response)
+
+
+class Throttle(object):
+    """Pace requests using Canvas' X-Rate-Limit-Remaining header.
+
+    Canvas throttles with a leaky bucket and answers 403 "Rate Limit Exceeded"
+    once it is empty. Requests run at full speed while the remaining quota is
+    above low_water and are delayed proportionally as it drains towards zero.
+    Throttled requests are retried with exponential backoff, as are GETs Canvas
+    answers 503, which it does while it builds a response in the background.
+    """
+
+    def __init__(self, low_water=300.0, max_delay=2.0, retries=5):
+        self.low_water = low_water
+        self.max_delay = max_delay
+        self.retries = retries
+        self.remaining = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        remaining = self.remaining
+        if remaining is None or remaining >= self.low_water:
+            return
+        time.sleep(self.max_delay * (1 - max(remaining, 0) / self.low_water))
+
+    def update(self, response):
+        remaining = response.headers.get("X-Rate-Limit-Remaining")
+        if remaining is not None:
+            with self._lock:
+                self.remaining = float(remaining)
+
+    def __call__(self, send, method, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.wait()
+            response = send(method, url, **kwargs)
+            self.update(response)
+            throttled = response.status_code == 403 and "Rate Limit Exceeded" in (
+                response.text
+            )
+            throttled = throttled or (
+                response.status_code == 503 and method.upper() == "GET"
+            )
+            # File uploads can't be replayed once their stream has been read
+            if not throttled or kwargs.get("files") or attempt == self.retries:
+                return response
+            time.sleep(self.max_delay * 2**attempt)
+        return response
+
+
+class HTTPCache(object):
+    """Keep GET responses in .kannwas/http.sqlite and revalidate them with ETags.
+
+    A cached response younger than max_age seconds is returned without a
+    request. Older ones are revalidated with If-None-Match, so an unchanged
+    resource costs a 304 instead of its body. Entries are keyed by URL and a
+    hash of the access token, and the least recently used are evicted once
+    the cache holds more than max_size bytes.
+    """
+
+    def __init__(self, root: Path, max_age=0, max_size=200 * 1024 * 1024):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.hits = self.revalidated = self.downloaded = 0
+        self._lock = threading.Lock()
+        path = state_path(root, "http.sqlite")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+            "url TEXT, etag TEXT, headers TEXT, body BLOB, size INTEGER, "
+            "stored_at REAL, used_at REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+        )
+        self.db.commit()
+
+    def key(self, url, kwargs):
+        url = requests.Request("GET", url, params=kwargs.get("params")).prepare().url
+        token = (kwargs.get("headers") or {}).get("Authorization", "")
+        return url, text_hash(f"{text_hash(token)} {url}")
+
+    def lookup(self, key):
+        with self._lock:
+            return self.db.execute(
+                "SELECT url, etag, headers, body, stored_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+    def touch(self, key, stored_at=None):
+        now = time.time()
+        with self._lock:
+            if stored_at is None:
+                self.db.execute(
+                    "UPDATE responses SET used_at = ? WHERE key = ?", (now, key)
+                )
+            else:
+                self.db.execute(
+                    "UPDATE responses SET used_at = ?, stored_at = ? WHERE key = ?",
+                    (now, stored_at, key),
+                )
+            self.db.commit()
+
+    def store(self, key, url, response):
+        now = time.time()
+        body = response.content
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    response.headers.get("ETag"),
+                    json.dumps(dict(response.headers)),
+                    body,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+        rows = self.db.execute(
+            "SELECT key, size FROM responses ORDER BY used_at"
+        ).fetchall()
+        for key, size in rows:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def cached_response(self, url, headers, body, request=None):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = body
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.request = request
+        return response
+
+    def __call__(self, send, method, url, **kwargs):
+        if method.upper() != "GET":
+            return send(method, url, **kwargs)
+        full_url, key = self.key(url, kwargs)
+        cached = self.lookup(key)
+        if cached is not None:
+            cached_url, etag, headers, body, stored_at = cached
+            if time.time() - stored_at < self.max_age:
+                self.touch(key)
+                self.hits += 1
+                return self.cached_response(cached_url, headers, body)
+            if etag:
+                kwargs["headers"] = {
+                    **(kwargs.get("headers") or {}),
+                    "If-None-Match": etag,
+                }
+
+        response = send(method, url, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.touch(key, stored_at=time.time())
+            self.revalidated += 1
+            return self.cached_response(cached_url, headers, body, response.request)
+        self.downloaded += 1
+        cacheable = response.headers.get("ETag") or self.max_age > 0
+        no_store = "no-store" in response.headers.get("Cache-Control", "")
+        if response.status_code == 200 and cacheable and not no_store:
+            self.store(key, response.url or full_url, response)
+        return response
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def summary(self) -> str:
+        return (
+            f"HTTP cache: {self.hits} fresh, {self.revalidated} revalidated, "
+            f"{self.downloaded} downloaded"
+        )
@@ -1,5 +1,9 @@
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 from kannwas.models import Student
+from kannwas.requester import paginate
+from kannwas.util import write_csv
 
 
 def getSection(user) -> str | None:
@@ -25,40 +29,122 @@ def getUnikey(user) -> str | None:
     return None
 
 
-def getGroup(user, groups) -> str | None:
+def getGroupIndex(groups, categories) -> dict[int, dict[str, str]]:
+    """Map each user id to their group name in every group category."""
+    category_names = {category.id: category.name for category in categories}
+    index = {}
     for group in groups:
+        category = category_names.get(
+            group.group_category_id, str(group.group_category_id)
+        )
         for guser in group.users:
-            if user.id == guser["id"]:
-                return group.name
+            index.setdefault(guser["id"], {}).setdefault(category, group.name)
+    return index
+
+
+def getGroup(user, index) -> str | None:
+    # The group of the first category the user belongs to
+    for group in index.get(user.id, {}).values():
+        return group
     return None
 
 
-def getStudents(course) -> list[Student]:
-    users = course.get_users(enrollment_type=["student"], include=["enrollments"])
-    groups = course.get_groups(include=["users"])
-    students = []
-    for user in users:
-        section = getSection(user)
-        group = getGroup(user, groups)
-        students.append(
-            Student(
-                id=user.id,
-                sid=getSID(user),
-                name=user.name,
-                unikey=getUnikey(user),
-                email=user.email,
-                section=section,
-                group=group,
-            )
+def loadGroupIndex(course):
+    """Fetch the groups and group sets concurrently.
+
+    Returns the getGroupIndex of the course and the names of its group sets.
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        groups = pool.submit(
+            lambda: list(paginate(course.get_groups(include=["users"])))
         )
-    return students
+        categories = pool.submit(lambda: list(paginate(course.get_group_categories())))
+    index = getGroupIndex(groups.result(), categories.result())
+    names = [category.name for category in categories.result()]
+    names.extend(name for groups in index.values() for name in groups)
+    return index, list(dict.fromkeys(names))
+
+
+def getStudent(user, index) -> Student:
+    return Student(
+        id=user.id,
+        sid=getSID(user),
+        name=user.name,
+        unikey=getUnikey(user),
+        email=user.email,
+        section=getSection(user),
+        group=getGroup(user, index),
+        groups=index.get(user.id, {}),
+    )
+
+
+def getUsers(course):
+    return paginate(
+        course.get_users(enrollment_type=["student"], include=["enrollments"])
+    )
+
+
+def prefetch(items):
+    """Iterate items on a thread, returning an iterator over what it has read.
+
+    Lets a listing overlap with whatever runs before the iterator is consumed.
+    Errors of the listing are raised by the iterator.
+    """
+    buffer = queue.Queue()
+    done = object()
+
+    def read():
+        try:
+            for item in items:
+                buffer.put((item, None))
+            buffer.put((done, None))
+        except Exception as e:
+            buffer.put((done, e))
+
+    def drain():
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+
+    threading.Thread(target=read, daemon=True).start()
+    return drain()
+
+
+def streamStudents(course):
+    """Return the names of the course's group sets and an iterator over its
+    students as their pages arrive.
+
+    The users are listed while the groups are fetched, as in getStudents.
+    """
+    users = prefetch(getUsers(course))
+    index, categories = loadGroupIndex(course)
+    return categories, (getStudent(user, index) for user in users)
+
+
+def getStudents(course) -> list[Student]:
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        users = pool.submit(lambda: list(getUsers(course)))
+        index, _ = loadGroupIndex(course)
+    return [getStudent(user, index) for user in users.result()]
 
 
 def downloadRoster(course, path):
-    students = getStudents(course)
-    students = [student.model_dump() for student in students]
-    roster = pd.DataFrame(students)
-    roster.to_csv(path, index=False)
+    categories, students = streamStudents(course)
+    fields = [field for field in Student.model_fields if field != "groups"]
+    columns = [f"group ({category})" for category in categories]
+
+    def rows():
+        for student in students:
+            row = student.model_dump(exclude={"groups"})
+            groups = student.groups.items()
+            row.update({f"group ({category})": name for category, name in groups})
+            yield row
+
+    write_csv(path, fields + columns, rows())
 
 def downloadStudentsWithoutGroup(course, path):
     pass
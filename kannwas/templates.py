@@ -0,0 +1,107 @@
+from functools import lru_cache
+from pathlib import Path
+import os
+import tempfile
+import threading
+import time
+
+from mako.lookup import TemplateLookup
+from mako.template import Template
+
+from kannwas.cache import state_path, text_hash
+
+
+# Compiled template modules are kept in .kannwas/mako, keyed by source hash
+MODULE_DIR = state_path(Path("."), "mako")
+
+# The least recently used templates are pruned beyond this size
+MAX_SIZE = 50 * 1024 * 1024
+
+_templates = {}
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_lookup(directory: str | None = None) -> TemplateLookup:
+    """Return the shared lookup for a templates directory.
+
+    Templates found through the lookup (includes, inherits) are compiled once
+    into the module directory and reloaded from there on later runs.
+    """
+    directories = [directory] if directory is not None else []
+    return TemplateLookup(
+        directories=directories, module_directory=(MODULE_DIR / "lookup").as_posix()
+    )
+
+
+def _write_source(path: Path, source: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(source)
+    os.replace(tmp, path)
+
+
+def get_template(source: str, directory: str | None = None) -> Template:
+    """Return a compiled template for source, rendering against directory's lookup.
+
+    Templates are cached for the lifetime of the process and their compiled
+    modules on disk, so unchanged sources are never compiled twice.
+    """
+    digest = text_hash(source)
+    key = (digest, directory)
+    with _lock:
+        template = _templates.get(key)
+        if template is None:
+            # Mako only caches modules of file based templates, so the source
+            # is stored under its hash and loaded from there. The bare uri keeps
+            # includes resolving against the lookup as for in-memory templates
+            source_path = MODULE_DIR / "src" / f"{digest}.mako"
+            if not source_path.exists():
+                _write_source(source_path, source)
+            module_path = MODULE_DIR / f"{digest}.py"
+            template = Template(
+                filename=source_path.as_posix(),
+                uri=f"memory:{digest}",
+                module_filename=module_path.as_posix(),
+                lookup=get_lookup(directory),
+            )
+            # The module's mtime records when the template was last used.
+            # Mako only recompiles modules older than their source
+            now = time.time()
+            os.utime(module_path, (now, now))
+            _templates[key] = template
+    return template
+
+
+def prune_templates(max_size: int = MAX_SIZE) -> int:
+    """Delete the least recently used compiled templates beyond max_size bytes.
+
+    Templates used by this process are always kept. Returns the number of
+    templates deleted.
+    """
+    with _lock:
+        used = {digest for digest, _ in _templates}
+        entries = []
+        for source_path in (MODULE_DIR / "src").glob("*.mako"):
+            module_path = MODULE_DIR / f"{source_path.stem}.py"
+            used_at = module_path.stat().st_mtime if module_path.exists() else 0
+            size = source_path.stat().st_size
+            size += module_path.stat().st_size if module_path.exists() else 0
+            entries.append((used_at, size, source_path.stem))
+
+        total = 0
+        deleted = 0
+        for _, size, digest in sorted(entries, reverse=True):
+            total += size
+            if total > max_size and digest not in used:
+                (MODULE_DIR / f"{digest}.py").unlink(missing_ok=True)
+                (MODULE_DIR / "src" / f"{digest}.mako").unlink(missing_ok=True)
+                deleted += 1
+    return deleted
+
+
+def render_file(path: Path, **context) -> str:
+    """Render a template file, e.g. lms.yml, through the shared template cache."""
+    with open(path, "r", encoding="utf-8") as f:
+        return get_template(f.read()).render(**context)
@@ -0,0 +1,155 @@
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import json
+import re
+import threading
+import time
+
+
+def endpoint_template(url: str) -> str:
+    """Return the path of url with ids replaced, e.g. courses/:id/pages/:id."""
+    path = urlsplit(url).path
+    path = re.sub(r"^/api/v1/", "", path).strip("/")
+    segments = [
+        ":id"
+        if re.fullmatch(r"\d+|(?=[\w-]*\d)[\w-]{6,}|sis_\w+:.*", segment)
+        else segment
+        for segment in path.split("/")
+    ]
+    return "/".join(segments)
+
+
+def page_number(url: str):
+    """Return the pagination page a request asks for, 1 if it isn't paginated."""
+    page = parse_qs(urlsplit(url).query).get("page")
+    if not page:
+        return 1
+    return int(page[0]) if page[0].isdigit() else page[0]
+
+
+def body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    if isinstance(body, bytes):
+        return len(body)
+    return 0
+
+
+class Tracer(object):
+    """Record every HTTP request kannwas makes.
+
+    Use as a middleware for the canvasapi requester (see add_middleware) and,
+    through httpx_hooks, for the Padlet client.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, method, url, status, latency, request_bytes, response_bytes):
+        with self._lock:
+            self.requests.append(
+                {
+                    "start": round(time.time() - latency - self.started, 4),
+                    "method": method.upper(),
+                    "host": urlsplit(url).netloc,
+                    "endpoint": endpoint_template(url),
+                    "page": page_number(url),
+                    "status": status,
+                    "latency": round(latency, 4),
+                    "request_bytes": request_bytes,
+                    "response_bytes": response_bytes,
+                }
+            )
+
+    def __call__(self, send, method, url, **kwargs):
+        started = time.perf_counter()
+        response = send(method, url, **kwargs)
+        latency = time.perf_counter() - started
+        self.record(
+            method,
+            response.url or url,
+            response.status_code,
+            latency,
+            body_size(response.request.body if response.request else None),
+            len(response.content),
+        )
+        return response
+
+    def httpx_hooks(self) -> dict:
+        """Return event hooks that record the requests of an httpx.AsyncClient."""
+
+        async def on_request(request):
+            request.extensions["trace_started"] = time.perf_counter()
+
+        async def on_response(response):
+            await response.aread()
+            request = response.request
+            latency = time.perf_counter() - request.extensions["trace_started"]
+            self.record(
+                request.method,
+                str(request.url),
+                response.status_code,
+                latency,
+                len(request.content),
+                len(response.content),
+            )
+
+        return {"request": [on_request], "response": [on_response]}
+
+    def summary(self) -> list[dict]:
+        """Aggregate the requests per method and endpoint, slowest in total first."""
+        endpoints = {}
+        for request in self.requests:
+            key = (request["method"], request["endpoint"])
+            row = endpoints.setdefault(
+                key,
+                {
+                    "method": request["method"],
+                    "endpoint": request["endpoint"],
+                    "calls": 0,
+                    "total_time": 0.0,
+                    "bytes": 0,
+                    "errors": 0,
+                },
+            )
+            row["calls"] += 1
+            row["total_time"] += request["latency"]
+            row["bytes"] += request["response_bytes"]
+            row["errors"] += request["status"] >= 400
+        rows = sorted(
+            endpoints.values(), key=lambda row: (-row["total_time"], -row["calls"])
+        )
+        for row in rows:
+            row["total_time"] = round(row["total_time"], 4)
+        return rows
+
+    def save(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "duration": round(time.time() - self.started, 4),
+                    "summary": self.summary(),
+                    "requests": self.requests,
+                },
+                f,
+                indent=1,
+            )
+
+    def format_summary(self, top=15) -> str:
+        rows = self.summary()
+        total = sum(row["total_time"] for row in rows)
+        lines = [
+            f"{len(self.requests)} requests, {total:.2f}s total request time",
+            f"{'calls':>6} {'time (s)':>9} {'mean (ms)':>10} {'bytes':>11}  endpoint",
+        ]
+        for row in rows[:top]:
+            lines.append(
+                f"{row['calls']:>6} {row['total_time']:>9.2f} "
+                f"{row['total_time'] / row['calls'] * 1000:>10.1f} "
+                f"{row['bytes']:>11}  {row['method']} {row['endpoint']}"
+            )
+        return "\n".join(lines)
@@ -1,6 +1,40 @@
+import csv
 import random
 
 
+def write_csv(path, fieldnames, rows) -> int:
+    """Write dict rows to a CSV file as they are produced, without holding
+    them in memory. Returns the number of rows written."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def merge_csv(path, parts) -> int:
+    """Merge the CSV files of several courses into one with a course_id column.
+
+    parts is a list of (course id, CSV path). The columns are the union of the
+    parts' columns in order of appearance. Returns the number of rows written.
+    """
+    fieldnames = {"course_id": None}
+    for _, part in parts:
+        with open(part, newline="", encoding="utf-8") as f:
+            fieldnames.update(dict.fromkeys(next(csv.reader(f), [])))
+
+    def rows():
+        for course_id, part in parts:
+            with open(part, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    yield {"course_id": course_id, **row}
+
+    return write_csv(path, list(fieldnames), rows())
+
+
 def generate_schedule(num_weeks, num_questions, groups):
     """
     Generate a random presentation schedule in Markdown format.
@@ -0,0 +1,206 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from kannwas.assignment import (
+    OVERRIDE_BATCH_SIZE,
+    diffOverrides,
+    getFailedUpdates,
+    getRubricChanges,
+    updateDueDates,
+)
+
+
+RUBRIC = [
+    {"id": "_1", "description": "Criterion 1"},
+    {"id": "_2", "description": "Criterion 2"},
+]
+
+
+class Assignment(object):
+    def __init__(self, submissions):
+        self.submissions = submissions
+
+    def get_submissions(self, include=None):
+        return self.submissions
+
+
+class Override(object):
+    def __init__(self, id, due_at=None, lock_at=None, unlock_at=None, **fields):
+        self.id = id
+        self.due_at = due_at
+        self.lock_at = lock_at
+        self.unlock_at = unlock_at
+        self.deleted = False
+        self.__dict__.update(fields)
+
+    def delete(self):
+        self.deleted = True
+
+
+class Course(object):
+    """Records the batches sent to Canvas' batch override endpoints."""
+
+    id = 1
+
+    def __init__(self, overrides):
+        self.assignment = SimpleNamespace(id=7, get_overrides=lambda: overrides)
+        self.updated = []
+        self.created = []
+
+    def get_assignment(self, assignment):
+        return self.assignment
+
+    def update_assignment_overrides(self, batch):
+        self.updated.append(batch)
+        return batch
+
+    def create_assignment_overrides(self, batch):
+        self.created.append(batch)
+        return batch
+
+
+def submission(user_id, rubric_assessment):
+    return SimpleNamespace(user_id=user_id, rubric_assessment=rubric_assessment)
+
+
+def test_rubric_changes_keep_unscored_criteria_without_points():
+    current = submission(
+        1,
+        {
+            "_1": {"rating_id": None, "comments": "", "points": 10.0},
+            "_2": {"rating_id": None, "comments": "", "points": None},
+        },
+    )
+    row = pd.Series({"id": 1, "Criterion 1": 15, "Criterion 2": float("nan")})
+
+    changes = getRubricChanges(RUBRIC, current, row)
+
+    assert changes == {"_1": {"comments": "", "points": 15.0}, "_2": {"comments": ""}}
+
+
+def test_rubric_changes_none_when_points_unchanged():
+    current = submission(1, {"_1": {"points": 10.0}, "_2": {"points": 5.0}})
+    row = pd.Series({"id": 1, "Criterion 1": 10, "Criterion 2": float("nan")})
+
+    assert getRubricChanges(RUBRIC, current, row) is None
+
+
+def test_failed_updates_skip_criteria_without_points():
+    current = submission(
+        1,
+        {
+            "_1": {"rating_id": None, "comments": "", "points": 10.0},
+            "_2": {"rating_id": None, "comments": "", "points": None},
+        },
+    )
+    row = pd.Series({"id": 1, "Criterion 1": 15, "Criterion 2": float("nan")})
+    grade_data = {1: {"rubric_assessment": getRubricChanges(RUBRIC, current, row)}}
+
+    updated = submission(1, {"_1": {"points": 15.0}, "_2": {"points": None}})
+    assert getFailedUpdates(Assignment([updated]), grade_data) == []
+    assert getFailedUpdates(Assignment([current]), grade_data) == [1]
+
+
+DUE = "2025-03-01T23:59:00+00:00"
+LOCK = "2025-03-08T23:59:00+00:00"
+
+
+def test_diff_overrides_updates_creates_and_deletes():
+    unchanged = Override(1, due_at=DUE, group_id=10)
+    moved = Override(2, due_at=DUE, group_id=11)
+    removed = Override(3, due_at=DUE, group_id=12)
+    desired = [
+        {"group_id": 10, "due_at": DUE, "lock_at": None, "unlock_at": None},
+        {"group_id": 11, "due_at": LOCK, "lock_at": None, "unlock_at": None},
+        {"group_id": 13, "due_at": DUE, "lock_at": None, "unlock_at": None},
+    ]
+
+    creates, updates, deletes = diffOverrides([unchanged, moved, removed], desired)
+
+    assert creates == [desired[2]]
+    assert updates == [(moved, desired[1])]
+    assert deletes == [removed]
+
+
+def test_diff_overrides_reuses_student_overrides():
+    existing = Override(1, due_at=DUE, student_ids=["3", "4"], title="extension-0")
+    desired = [
+        {
+            "student_ids": [3, 5],
+            "title": "extension-0",
+            "due_at": DUE,
+            "lock_at": None,
+            "unlock_at": None,
+        },
+        {
+            "student_ids": [6],
+            "title": "extension-1",
+            "due_at": LOCK,
+            "lock_at": None,
+            "unlock_at": None,
+        },
+    ]
+
+    creates, updates, deletes = diffOverrides([existing], desired)
+
+    # Same dates, so the existing override takes the new students
+    assert updates == [(existing, desired[0])]
+    assert creates == [desired[1]]
+    assert deletes == []
+
+
+def test_due_dates_send_cleared_dates(tmp_path):
+    override = Override(
+        1, due_at=DUE, lock_at=LOCK, student_ids=[3], title="extension-0"
+    )
+    course = Course([override])
+    extensions = tmp_path / "extensions.csv"
+    extensions.write_text(f"id,due_at,lock_at,unlock_at\n3,{DUE},,\n")
+
+    updateDueDates(course, 7, extensions)
+
+    # None would be left out of the request and Canvas would keep the old date
+    assert course.updated == [
+        [
+            {
+                "id": 1,
+                "assignment_id": 7,
+                "student_ids": [3],
+                "title": "extension-0",
+                "due_at": DUE,
+                "lock_at": "",
+                "unlock_at": "",
+            }
+        ]
+    ]
+    assert course.created == []
+    assert not override.deleted
+
+
+def test_due_dates_send_overrides_in_batches(tmp_path):
+    count = 2 * OVERRIDE_BATCH_SIZE + 1
+    existing = [
+        Override(i, due_at=DUE, group_id=i) for i in range(OVERRIDE_BATCH_SIZE + 1)
+    ]
+    course = Course(existing)
+    groups = [SimpleNamespace(name=f"G{i}", id=i) for i in range(count)]
+    course.get_groups = lambda: groups
+    extensions = tmp_path / "extensions.csv"
+    extensions.write_text(
+        "group,due_at,lock_at,unlock_at\n"
+        + "".join(f"G{i},{LOCK},,\n" for i in range(count))
+    )
+
+    updateDueDates(course, 7, extensions)
+
+    assert [len(batch) for batch in course.updated] == [OVERRIDE_BATCH_SIZE, 1]
+    assert [len(batch) for batch in course.created] == [OVERRIDE_BATCH_SIZE]
+    updated = [data for batch in course.updated for data in batch]
+    assert [data["id"] for data in updated] == [o.id for o in existing]
+    assert all(data["assignment_id"] == 7 for data in updated)
+    created = course.created[0]
+    assert all("id" not in data and data["assignment_id"] == 7 for data in created)
+    assert [data["group_id"] for data in created] == list(
+        range(OVERRIDE_BATCH_SIZE + 1, count)
+    )